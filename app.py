@@ -5,12 +5,31 @@ from datetime import datetime
 import firebase_admin
 from firebase_admin import credentials, firestore
 import io
+import sys
 import hashlib
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import random
 import string
+import threading
+import queue
+import time
+import uuid
+import os
+import json
+import logging
+import logging.handlers
+import contextlib
+import pickle
+import sqlite3
+import asyncio
+import importlib.util
+import math
+import abc
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 # --------------------------------------------------------------------------
 # 1. AYARLAR VE DİL SÖZLÜĞÜ
@@ -29,7 +48,7 @@ TRANSLATIONS = {
         "forgot_pass_btn": "Şifremi Unuttum",
         "reset_pass_header": "🔑 Şifre Sıfırlama",
         "reset_pass_btn": "Yeni Şifre Gönder",
-        "reset_success": "Yeni şifreniz e-posta adresinize gönderildi.",
+        "reset_success": "Yeni şifreniz e-posta ile gönderilmek üzere sıraya alındı.",
         "reset_error_mail": "E-posta gönderilirken hata oluştu.",
         "reset_error_user": "Bu e-posta adresiyle kayıtlı kullanıcı bulunamadı.",
         "login_success": "Giriş Başarılı!",
@@ -60,7 +79,7 @@ TRANSLATIONS = {
         "error_parse": "Veriler okunamadı.",
         "excel_title": "📂 Excel ile Çoklu Model Kontrolü",
         "excel_info": "Dosya içerisinde istediğiniz kadar Gerber ve Polypattern sayfası bulunabilir.",
-        "upload_label": "Excel Dosyasını Yükleyin (.xlsx)",
+        "upload_label": "Dosya Yükleyin (.xlsx, .csv, .tsv, .parquet, .txt)",
         "analyze_file_btn": "🚀 Dosyayı Analiz Et",
         "reset_btn": "🔄 Sıfırla",
         "save_all_btn": "💾 Tüm Modelleri Kaydet",
@@ -94,7 +113,81 @@ TRANSLATIONS = {
         "result": "Sonuç",
         "cevre_label": "Çevre",
         "en_label": "En",
-        "boy_label": "Boy"
+        "boy_label": "Boy",
+        "mail_status": "E-posta durumu",
+        "mail_queued": "Sırada",
+        "mail_sending": "Gönderiliyor",
+        "mail_sent": "Gönderildi",
+        "mail_failed": "Gönderilemedi",
+        "email_taken_err": "Bu e-posta adresi başka bir kullanıcıya ait.",
+        "change_email_title": "E-posta Güncelle",
+        "update_email_btn": "E-postayı Kaydet",
+        "email_updated": "E-posta güncellendi.",
+        "user_filter": "🔍 Kullanıcı Ara",
+        "page": "Sayfa",
+        "bulk_title": "📥 Toplu Kullanıcı İşlemleri",
+        "bulk_import_tab": "İçe Aktar",
+        "bulk_role_tab": "Yetki Değiştir",
+        "bulk_delete_tab": "Sil",
+        "bulk_columns_info": "Sütunlar: username, role, email, password (opsiyonel; boşsa geçici şifre üretilir)",
+        "bulk_upload_label": "Kullanıcı Listesi (.csv / .xlsx)",
+        "bulk_fix_errors": "Dosyadaki hatalı satırları düzeltip tekrar yükleyin. Hiçbir kullanıcı eklenmedi.",
+        "bulk_send_mail": "Hesap bilgilerini e-posta ile gönder",
+        "bulk_import_btn": "Kullanıcıları Oluştur",
+        "bulk_import_done": "Oluşturulan kullanıcı",
+        "bulk_credentials_dl": "⬇️ Hesap bilgilerini indir (.csv)",
+        "bulk_select_users": "Kullanıcılar",
+        "bulk_apply_role_btn": "Yetkiyi Uygula",
+        "bulk_delete_btn": "Seçilenleri Sil",
+        "bulk_confirm": "Silme işlemini onaylıyorum",
+        "bulk_done": "İşlem tamamlandı",
+        "diag_title": "🩺 Tanılama",
+        "diag_enable": "Ölçümü aç (bu oturum)",
+        "diag_empty": "Henüz ölçüm yok.",
+        "diag_last_run": "Son çalıştırma",
+        "diag_reads": "Firestore okuma",
+        "diag_writes": "Firestore yazma",
+        "diag_session": "Oturum toplamı",
+        "changes_since_last": "Önceki yüklemeye göre değişiklikler (yeni | değişen | kaldırılan | aynı)",
+        "show_only_changed": "Sadece değişen parçaları göster",
+        "live_mode": "⚡ Canlı analiz",
+        "live_mode_help": "Bir parçanın metni değiştiğinde (alan dışına çıkınca veya Ctrl+Enter) sadece o parça yeniden analiz edilir.",
+        "job_queued": "Sırada",
+        "job_running": "Analiz ediliyor",
+        "job_limit": "Aynı anda çalıştırabileceğiniz analiz sınırına ulaştınız. Lütfen birinin bitmesini bekleyin.",
+        "job_cancel_btn": "⏹️ Analizi İptal Et",
+        "job_cancelled": "Analiz iptal edildi.",
+        "upload_formats_help": "CSV/TSV/Parquet: satır başına bir ölçü; sütunlar kaynak (gerber/pp), parca, beden, boy, en, cevre. TXT: manuel sayfadaki metinler, her blok ### CEVRE / ### EN / ### BOY / ### PP satırıyla başlar.",
+        "menu_dashboard": "Kalite Panosu",
+        "dashboard_title": "📊 Kalite Panosu",
+        "date_from": "Başlangıç",
+        "date_to": "Bitiş",
+        "total_records": "Toplam Kayıt",
+        "fault_rate": "Hata Oranı",
+        "no_data": "Bu aralıkta veri yok.",
+        "rebuild_rollups_btn": "Özetleri Yeniden Oluştur",
+        "rebuild_rollups_info": "Tüm kayıtları bir kez tarar; özetler öncesi kayıtları panoya dahil etmek için kullanın. Kayıt yapılmayan bir saatte çalıştırın.",
+        "rollups_rebuilt": "Yeniden yazılan özet",
+        "drift_title": "Sapma Dağılımı",
+        "drift_info": "|Fark| yüzdelikleri (cm) kayıt anında güncellenen özetlerden hesaplanır; ~%1 göreli hata payı vardır. Toleransı aşan p95 değerleri işaretlenir.",
+        "drift_dims": "Ölçüler",
+        "outbox_pending": "Aktarım bekleyen kayıt",
+        "outbox_retry_btn": "Şimdi Dene",
+        "duplicate_skipped": "Zaten kayıtlı olduğu için atlanan model",
+        "tolerance_rules_count": "kural",
+        "tolerance_rules_title": "Tolerans Kuralları",
+        "tolerance_rules_help": "Varsayılan toleransı BU, ölçü ve beden bazında değiştirir. Birden fazla kural eşleşirse en özel olan (BU > beden > ölçü) geçerlidir; * hepsi anlamına gelir.",
+        "rule_dim": "Ölçü",
+        "rule_sizes": "Bedenler",
+        "rule_sizes_help": "Boş: tüm bedenler, 36-44: sayısal aralık, S,M,L: liste",
+        "save_rules_btn": "Kuralları Kaydet",
+        "rules_invalid": "Geçersiz kural",
+        "bulk_mail_failed": "Hesap bilgisi maili kuyruğa alınamayan kullanıcı",
+        "save_queued": "Kayıt sıraya alındı; arka planda veritabanına aktarılacak",
+        "outbox_failed": "Aktarılamayan kayıt",
+        "dup_email_title": "Aynı e-postayı paylaşan kullanıcılar",
+        "dup_email_help": "Şifre sıfırlama maili sadece e-posta indeksindeki kullanıcıya gider; diğerlerinin e-postasını aşağıdan değiştirin.",
+        "diag_rss_peak": "Tepe RSS"
     },
     "ENG": {
         "app_title": "🏭 Pattern Measure Control System",
@@ -106,7 +199,7 @@ TRANSLATIONS = {
         "forgot_pass_btn": "Forgot Password",
         "reset_pass_header": "🔑 Reset Password",
         "reset_pass_btn": "Send New Password",
-        "reset_success": "New password sent to your email.",
+        "reset_success": "Your new password has been queued for delivery by email.",
         "reset_error_mail": "Error sending email.",
         "reset_error_user": "No user found with this email address.",
         "login_success": "Login Successful!",
@@ -137,7 +230,7 @@ TRANSLATIONS = {
         "error_parse": "Could not parse data.",
         "excel_title": "📂 Multi-Model Control via Excel",
         "excel_info": "File can contain multiple Gerber and Polypattern sheets.",
-        "upload_label": "Upload Excel File (.xlsx)",
+        "upload_label": "Upload File (.xlsx, .csv, .tsv, .parquet, .txt)",
         "analyze_file_btn": "🚀 Analyze File",
         "reset_btn": "🔄 Reset",
         "save_all_btn": "💾 Save All Models",
@@ -171,7 +264,81 @@ TRANSLATIONS = {
         "result": "Result",
         "cevre_label": "Circumference",
         "en_label": "Width",
-        "boy_label": "Length"
+        "boy_label": "Length",
+        "mail_status": "Email status",
+        "mail_queued": "Queued",
+        "mail_sending": "Sending",
+        "mail_sent": "Sent",
+        "mail_failed": "Failed",
+        "email_taken_err": "This email address belongs to another user.",
+        "change_email_title": "Update Email",
+        "update_email_btn": "Save Email",
+        "email_updated": "Email updated.",
+        "user_filter": "🔍 Search User",
+        "page": "Page",
+        "bulk_title": "📥 Bulk User Operations",
+        "bulk_import_tab": "Import",
+        "bulk_role_tab": "Change Role",
+        "bulk_delete_tab": "Delete",
+        "bulk_columns_info": "Columns: username, role, email, password (optional; a temporary password is generated if empty)",
+        "bulk_upload_label": "User List (.csv / .xlsx)",
+        "bulk_fix_errors": "Fix the invalid rows and upload again. No users were added.",
+        "bulk_send_mail": "Email account details",
+        "bulk_import_btn": "Create Users",
+        "bulk_import_done": "Users created",
+        "bulk_credentials_dl": "⬇️ Download account details (.csv)",
+        "bulk_select_users": "Users",
+        "bulk_apply_role_btn": "Apply Role",
+        "bulk_delete_btn": "Delete Selected",
+        "bulk_confirm": "I confirm the deletion",
+        "bulk_done": "Done",
+        "diag_title": "🩺 Diagnostics",
+        "diag_enable": "Enable profiling (this session)",
+        "diag_empty": "No measurements yet.",
+        "diag_last_run": "Last run",
+        "diag_reads": "Firestore reads",
+        "diag_writes": "Firestore writes",
+        "diag_session": "Session total",
+        "changes_since_last": "Changes since previous upload (new | changed | removed | same)",
+        "show_only_changed": "Show only changed parts",
+        "live_mode": "⚡ Live analysis",
+        "live_mode_help": "When a part's text changes (on leaving the field or Ctrl+Enter) only that part is re-analysed.",
+        "job_queued": "Queued",
+        "job_running": "Analysing",
+        "job_limit": "You have reached the limit of concurrent analyses. Please wait for one to finish.",
+        "job_cancel_btn": "⏹️ Cancel Analysis",
+        "job_cancelled": "Analysis cancelled.",
+        "upload_formats_help": "CSV/TSV/Parquet: one measurement per row; columns source (gerber/pp), part, size, boy, en, cevre. TXT: the manual-page texts, each block starting with a ### CEVRE / ### EN / ### BOY / ### PP line.",
+        "menu_dashboard": "QC Dashboard",
+        "dashboard_title": "📊 QC Dashboard",
+        "date_from": "From",
+        "date_to": "To",
+        "total_records": "Total Records",
+        "fault_rate": "Fault Rate",
+        "no_data": "No data in this range.",
+        "rebuild_rollups_btn": "Rebuild Rollups",
+        "rebuild_rollups_info": "Scans all records once; use it to include records saved before rollups existed. Run it when nobody is saving.",
+        "rollups_rebuilt": "Rollups rewritten",
+        "drift_title": "Drift Distribution",
+        "drift_info": "|Difference| percentiles (cm) are computed from summaries updated at save time, within ~1% relative error. p95 values above tolerance are highlighted.",
+        "drift_dims": "Dimensions",
+        "outbox_pending": "Records pending upload",
+        "outbox_retry_btn": "Retry Now",
+        "duplicate_skipped": "Models skipped as already saved",
+        "tolerance_rules_count": "rules",
+        "tolerance_rules_title": "Tolerance Rules",
+        "tolerance_rules_help": "Overrides the default tolerance per BU, dimension and size. If several rules match, the most specific one wins (BU > size > dimension); * means all.",
+        "rule_dim": "Dimension",
+        "rule_sizes": "Sizes",
+        "rule_sizes_help": "Empty: all sizes, 36-44: numeric range, S,M,L: list",
+        "save_rules_btn": "Save Rules",
+        "rules_invalid": "Invalid rule",
+        "bulk_mail_failed": "Users whose account mail could not be queued",
+        "save_queued": "Queued; it will be uploaded to the database in the background",
+        "outbox_failed": "Records that failed to upload",
+        "dup_email_title": "Users sharing the same email",
+        "dup_email_help": "Password reset mails only reach the user in the email index; change the others' email below.",
+        "diag_rss_peak": "Peak RSS"
     },
     "ARB": {
         "app_title": "🏭 نظام مراقبة قياس الأنماط",
@@ -183,7 +350,7 @@ TRANSLATIONS = {
         "forgot_pass_btn": "نسيت كلمة المرور",
         "reset_pass_header": "🔑 إعادة تعيين كلمة المرور",
         "reset_pass_btn": "إرسال كلمة مرور جديدة",
-        "reset_success": "تم إرسال كلمة المرور الجديدة إلى بريدك الإلكتروني.",
+        "reset_success": "تمت إضافة كلمة المرور الجديدة إلى قائمة الإرسال عبر البريد الإلكتروني.",
         "reset_error_mail": "حدث خطأ أثناء إرسال البريد الإلكتروني.",
         "reset_error_user": "لم يتم العثور على مستخدم بهذا البريد الإلكتروني.",
         "login_success": "تم تسجيل الدخول بنجاح!",
@@ -214,7 +381,7 @@ TRANSLATIONS = {
         "error_parse": "تعذر قراءة البيانات.",
         "excel_title": "📂 فحص متعدد النماذج عبر إكسل",
         "excel_info": "يمكن أن يحتوي الملف على أوراق متعددة.",
-        "upload_label": "تحميل ملف إكسل (.xlsx)",
+        "upload_label": "تحميل ملف (.xlsx, .csv, .tsv, .parquet, .txt)",
         "analyze_file_btn": "🚀 تحليل الملف",
         "reset_btn": "🔄 إعادة تعيين",
         "save_all_btn": "💾 حفظ جميع النماذج",
@@ -248,12 +415,96 @@ TRANSLATIONS = {
         "result": "النتيجة",
         "cevre_label": "المحيط",
         "en_label": "العرض",
-        "boy_label": "الطول"
+        "boy_label": "الطول",
+        "mail_status": "حالة البريد الإلكتروني",
+        "mail_queued": "في قائمة الانتظار",
+        "mail_sending": "جارٍ الإرسال",
+        "mail_sent": "تم الإرسال",
+        "mail_failed": "فشل الإرسال",
+        "email_taken_err": "عنوان البريد الإلكتروني هذا مستخدم من قبل مستخدم آخر.",
+        "change_email_title": "تحديث البريد الإلكتروني",
+        "update_email_btn": "حفظ البريد الإلكتروني",
+        "email_updated": "تم تحديث البريد الإلكتروني.",
+        "user_filter": "🔍 البحث عن مستخدم",
+        "page": "الصفحة",
+        "bulk_title": "📥 عمليات المستخدمين المجمعة",
+        "bulk_import_tab": "استيراد",
+        "bulk_role_tab": "تغيير الصلاحية",
+        "bulk_delete_tab": "حذف",
+        "bulk_columns_info": "الأعمدة: username, role, email, password (اختياري؛ يتم إنشاء كلمة مرور مؤقتة إذا كان فارغًا)",
+        "bulk_upload_label": "قائمة المستخدمين (.csv / .xlsx)",
+        "bulk_fix_errors": "صحح الصفوف غير الصالحة وأعد التحميل. لم تتم إضافة أي مستخدم.",
+        "bulk_send_mail": "إرسال بيانات الحساب بالبريد الإلكتروني",
+        "bulk_import_btn": "إنشاء المستخدمين",
+        "bulk_import_done": "المستخدمون الذين تم إنشاؤهم",
+        "bulk_credentials_dl": "⬇️ تنزيل بيانات الحسابات (.csv)",
+        "bulk_select_users": "المستخدمون",
+        "bulk_apply_role_btn": "تطبيق الصلاحية",
+        "bulk_delete_btn": "حذف المحدد",
+        "bulk_confirm": "أؤكد عملية الحذف",
+        "bulk_done": "تمت العملية",
+        "diag_title": "🩺 التشخيص",
+        "diag_enable": "تفعيل القياس (هذه الجلسة)",
+        "diag_empty": "لا توجد قياسات بعد.",
+        "diag_last_run": "آخر تشغيل",
+        "diag_reads": "قراءات Firestore",
+        "diag_writes": "كتابات Firestore",
+        "diag_session": "إجمالي الجلسة",
+        "changes_since_last": "التغييرات منذ التحميل السابق (جديد | متغير | محذوف | بدون تغيير)",
+        "show_only_changed": "عرض القطع المتغيرة فقط",
+        "live_mode": "⚡ تحليل مباشر",
+        "live_mode_help": "عند تغيير نص قطعة (عند مغادرة الحقل أو Ctrl+Enter) يتم إعادة تحليل تلك القطعة فقط.",
+        "job_queued": "في قائمة الانتظار",
+        "job_running": "جارٍ التحليل",
+        "job_limit": "لقد وصلت إلى الحد الأقصى للتحليلات المتزامنة. يرجى انتظار انتهاء أحدها.",
+        "job_cancel_btn": "⏹️ إلغاء التحليل",
+        "job_cancelled": "تم إلغاء التحليل.",
+        "upload_formats_help": "CSV/TSV/Parquet: قياس واحد لكل صف؛ الأعمدة source (gerber/pp)، part، size، boy، en، cevre. TXT: نصوص الصفحة اليدوية، تبدأ كل كتلة بسطر ### CEVRE / ### EN / ### BOY / ### PP.",
+        "menu_dashboard": "لوحة الجودة",
+        "dashboard_title": "📊 لوحة الجودة",
+        "date_from": "من",
+        "date_to": "إلى",
+        "total_records": "إجمالي السجلات",
+        "fault_rate": "نسبة الأخطاء",
+        "no_data": "لا توجد بيانات في هذا النطاق.",
+        "rebuild_rollups_btn": "إعادة بناء الملخصات",
+        "rebuild_rollups_info": "يفحص جميع السجلات مرة واحدة؛ استخدمه لتضمين السجلات المحفوظة قبل وجود الملخصات. شغّله عندما لا يقوم أحد بالحفظ.",
+        "rollups_rebuilt": "الملخصات المعاد كتابتها",
+        "drift_title": "توزيع الانحراف",
+        "drift_info": "تُحسب النسب المئوية لـ |الفرق| (سم) من ملخصات تُحدّث عند الحفظ بخطأ نسبي ~1٪. تُميَّز قيم p95 التي تتجاوز التسامح.",
+        "drift_dims": "الأبعاد",
+        "outbox_pending": "سجلات بانتظار الرفع",
+        "outbox_retry_btn": "أعد المحاولة الآن",
+        "duplicate_skipped": "نماذج تم تخطيها لأنها محفوظة بالفعل",
+        "tolerance_rules_count": "قواعد",
+        "tolerance_rules_title": "قواعد التسامح",
+        "tolerance_rules_help": "تتجاوز التسامح الافتراضي حسب وحدة العمل والبعد والمقاس. إذا تطابقت عدة قواعد تُطبَّق الأكثر تحديدًا (وحدة العمل > المقاس > البعد)؛ * تعني الكل.",
+        "rule_dim": "البعد",
+        "rule_sizes": "المقاسات",
+        "rule_sizes_help": "فارغ: كل المقاسات، 36-44: نطاق رقمي، S,M,L: قائمة",
+        "save_rules_btn": "حفظ القواعد",
+        "rules_invalid": "قاعدة غير صالحة",
+        "bulk_mail_failed": "مستخدمون تعذر إضافة بريد حساباتهم إلى قائمة الانتظار",
+        "save_queued": "تمت الإضافة إلى قائمة الانتظار؛ سيتم رفعه إلى قاعدة البيانات في الخلفية",
+        "outbox_failed": "سجلات تعذر رفعها",
+        "dup_email_title": "مستخدمون يتشاركون البريد الإلكتروني نفسه",
+        "dup_email_help": "يصل بريد إعادة تعيين كلمة المرور فقط إلى المستخدم المسجل في الفهرس؛ غيّر البريد الإلكتروني للآخرين أدناه.",
+        "diag_rss_peak": "ذروة RSS"
     }
 }
 
+class _EmulatorCredential(credentials.Base):
+    """Firestore emülatörü kimlik doğrulaması istemez; anonim kimlik döner."""
+
+    def get_credential(self):
+        from google.auth.credentials import AnonymousCredentials
+        return AnonymousCredentials()
+
 # Firebase başlatma (Secrets kullanarak)
-if not firebase_admin._apps:
+if not firebase_admin._apps and os.environ.get("FIRESTORE_EMULATOR_HOST"):
+    # Yerel emülatör (geliştirme ve yük testi): secrets gerekmez
+    firebase_admin.initialize_app(_EmulatorCredential(), {'projectId': os.environ.get("GOOGLE_CLOUD_PROJECT", "kalip-local")})
+elif not firebase_admin._apps:
     try:
         # Secrets verisini al
         key_dict = dict(st.secrets["firebase"])
@@ -267,12 +518,213 @@ if not firebase_admin._apps:
     except Exception as e:
         st.error(f"Firestore bağlantı hatası: {e}. Lütfen Secrets ayarlarını kontrol edin.")
 
-# DB İstemcisi
+# DB İstemcisi; async istemci (get_async_db) de aynı app ve veritabanını kullanır
+FIRESTORE_DATABASE = os.environ.get("KALIP_FIRESTORE_DATABASE") or None # None: (default)
 try:
-    db = firestore.client()
+    db = firestore.client(database_id=FIRESTORE_DATABASE)
 except:
     db = None 
 
+# --- PERFORMANS ÖLÇÜMÜ ---
+# KALIP_PERF=1 ortam değişkeni ile tüm oturumlarda, Tanılama panelinden de
+# sadece o oturum için açılır. Kapalıyken perf_stage boş bir context döner ve
+# fs_op tek bir attribute okumasıdır. Ölçümler iş parçacığına bağlıdır; mail
+# iş parçacığında kaydedilmez. Arka plan işleri, başlatıldıkları çalıştırmada
+# ölçüm açıksa kendi PerfRun'larına yazar ve sonuç alınırken bu aşamalar
+# "job:" önekiyle o anki çalıştırmaya eklenir.
+PERF_LOG_PATH = os.environ.get("KALIP_PERF_LOG", os.path.join("logs", "perf.jsonl"))
+PERF_LOG_MAX_BYTES = int(os.environ.get("KALIP_PERF_LOG_MAX_MB", 10)) * 1024 * 1024
+PERF_LOG_BACKUPS = 3 # perf.jsonl.1 ... .3; daha eskileri silinir
+# /proc olmayan sistemlerde anlık değer okunamaz; ru_maxrss (sürecin tepe değeri) kullanılır
+RSS_IS_PEAK = not os.path.exists("/proc/self/statm")
+_perf_local = threading.local()
+_NULL_STAGE = contextlib.nullcontext()
+
+def _rss_kb():
+    """Sürecin anlık bellek kullanımı (KB); RSS_IS_PEAK ise tepe değer."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError, AttributeError):
+        try:
+            import resource
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return peak // 1024 if sys.platform == "darwin" else peak # macOS bayt döner
+        except ImportError:
+            return 0
+
+class PerfRun:
+    """Tek bir script çalıştırmasının aşama süreleri ve Firestore işlem sayıları."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.page = None
+        self.stages = []
+        self.fs = {'read': 0, 'write': 0}
+
+class _PerfStage:
+    __slots__ = ('run', 'name', 't0', 'm0')
+
+    def __init__(self, run, name):
+        self.run = run
+        self.name = name
+
+    def __enter__(self):
+        self.m0 = _rss_kb()
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.run.stages.append({
+            'stage': self.name,
+            'ms': round((time.perf_counter() - self.t0) * 1000, 2),
+            'rss_delta_kb': _rss_kb() - self.m0
+        })
+        return False
+
+def perf_stage(name):
+    """`with perf_stage("read_excel"):` bloğunun süre ve bellek farkını kaydeder."""
+    run = getattr(_perf_local, 'run', None)
+    if run is None: return _NULL_STAGE
+    return _PerfStage(run, name)
+
+def fs_op(kind, n=1):
+    """Firestore okuma/yazma sayacını artırır (kind: 'read' veya 'write')."""
+    run = getattr(_perf_local, 'run', None)
+    if run is not None: run.fs[kind] += n
+
+def perf_merge(other, prefix):
+    """Başka bir iş parçacığında toplanan ölçümleri o anki çalıştırmaya ekler."""
+    run = getattr(_perf_local, 'run', None)
+    if run is None or other is None: return
+    run.stages.extend({**s, 'stage': prefix + s['stage']} for s in other.stages)
+    for kind, n in other.fs.items(): run.fs[kind] += n
+
+def perf_tag(page):
+    run = getattr(_perf_local, 'run', None)
+    if run is not None: run.page = page
+
+@st.cache_resource
+def _perf_logger():
+    """Yapısal (JSON satırları) performans günlüğü; PERF_LOG_MAX_BYTES'ta döndürülür."""
+    logger = logging.getLogger("kalip.perf")
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    if not logger.handlers:
+        os.makedirs(os.path.dirname(PERF_LOG_PATH) or ".", exist_ok=True)
+        handler = logging.handlers.RotatingFileHandler(PERF_LOG_PATH, maxBytes=PERF_LOG_MAX_BYTES, backupCount=PERF_LOG_BACKUPS, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+    return logger
+
+def perf_begin_run():
+    enabled = os.environ.get("KALIP_PERF") == "1" or st.session_state.get('perf_enabled', False)
+    _perf_local.run = PerfRun() if enabled else None
+
+def perf_end_run():
+    """Çalıştırma özetini oturuma ekler ve günlüğe yazar."""
+    run = getattr(_perf_local, 'run', None)
+    _perf_local.run = None
+    if run is None: return
+    try:
+        total_ms = round((time.perf_counter() - run.started) * 1000, 2)
+        record = {
+            'ts': datetime.now().isoformat(timespec='seconds'),
+            'session': session_uid(),
+            'user': st.session_state.get('username', ''),
+            'page': run.page, 'total_ms': total_ms,
+            'fs_read': run.fs['read'], 'fs_write': run.fs['write'],
+            'rss_kb': _rss_kb(), 'rss_peak': RSS_IS_PEAK, 'stages': run.stages
+        }
+        st.session_state['perf_last'] = record
+        totals = st.session_state.setdefault('perf_session', {'runs': 0, 'ms': 0.0, 'fs_read': 0, 'fs_write': 0})
+        totals['runs'] += 1; totals['ms'] += total_ms
+        totals['fs_read'] += run.fs['read']; totals['fs_write'] += run.fs['write']
+        _perf_logger().info(json.dumps(record, ensure_ascii=False, default=str))
+    except Exception:
+        pass # Ölçüm hatası uygulamayı etkilememeli
+
+# --- VERİ ERİŞİM KATMANI ---
+# Bir sayfanın birbirinden bağımsız okumaları (ayarlar, kayıt listesi,
+# doküman grupları) sırayla beklenmek yerine, arka planda sürekli çalışan bir
+# olay döngüsünde Firestore AsyncClient ile eş zamanlı yapılır; sayfa sadece en
+# yavaş okuma kadar bekler; alan maskesiyle sadece gereken alanlar çekilir.
+# Async istemci kullanılamazsa aynı okumalar senkron istemciyle sırayla yapılır.
+FETCH_TIMEOUT = 30 # sn
+
+def doc_read(path, fields=None):
+    """Tek doküman: sonuç dict (id dahil) veya None."""
+    return {'kind': 'doc', 'path': path, 'fields': fields}
+
+def query_read(collection, where=(), order_by=None, descending=True, limit=None, fields=None):
+    """Sorgu: sonuç dict listesi (id dahil). where: (alan, operatör, değer) listesi."""
+    return {'kind': 'query', 'collection': collection, 'where': list(where), 'order_by': order_by,
+            'descending': descending, 'limit': limit, 'fields': fields}
+
+def _snap_dict(snap):
+    return {**(snap.to_dict() or {}), 'id': snap.id}
+
+def _build_query(client, read):
+    query = client.collection(read['collection'])
+    for field, op, value in read['where']:
+        query = query.where(field, op, value)
+    if read['order_by']:
+        query = query.order_by(read['order_by'], direction=firestore.Query.DESCENDING if read['descending'] else firestore.Query.ASCENDING)
+    if read['limit']: query = query.limit(read['limit'])
+    if read['fields'] is not None: query = query.select(read['fields'])
+    return query
+
+async def _read_async(client, read):
+    if read['kind'] == 'doc':
+        snap = await client.document(read['path']).get(field_paths=read['fields'])
+        return _snap_dict(snap) if snap.exists else None
+    return [_snap_dict(snap) async for snap in _build_query(client, read).stream()]
+
+def _read_sync(client, read):
+    if read['kind'] == 'doc':
+        snap = client.document(read['path']).get(field_paths=read['fields'])
+        return _snap_dict(snap) if snap.exists else None
+    return [_snap_dict(snap) for snap in _build_query(client, read).stream()]
+
+@st.cache_resource
+def _async_loop():
+    """Async Firestore çağrıları için süreç genelinde tek olay döngüsü."""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="firestore-async", daemon=True).start()
+    return loop
+
+@st.cache_resource
+def get_async_db():
+    """Senkron istemciyle aynı firebase app (proje, kimlik) ve veritabanını kullanan async istemci."""
+    from google.cloud.firestore import AsyncClient
+    app = firebase_admin.get_app()
+    async def make():
+        # gRPC kanalı bu olay döngüsüne bağlanmalı
+        return AsyncClient(project=app.project_id, credentials=app.credential.get_credential(), database=FIRESTORE_DATABASE or "(default)")
+    return asyncio.run_coroutine_threadsafe(make(), _async_loop()).result(FETCH_TIMEOUT)
+
+def fetch(**reads):
+    """Adlandırılmış okumaları eş zamanlı yapar; {ad: sonuç} döner.
+
+    Örnek: fetch(config=doc_read('settings/config', ['tolerance']), records=query_read('qc_records', limit=100))
+    """
+    if not reads: return {}
+    if not db: return {name: (None if r['kind'] == 'doc' else []) for name, r in reads.items()}
+
+    async def gather(client):
+        results = await asyncio.gather(*(_read_async(client, r) for r in reads.values()))
+        return dict(zip(reads, results))
+
+    with perf_stage("firestore_fetch"):
+        try:
+            results = asyncio.run_coroutine_threadsafe(gather(get_async_db()), _async_loop()).result(FETCH_TIMEOUT)
+        except Exception:
+            logging.getLogger("kalip.fetch").warning("async fetch failed, reading sequentially", exc_info=True)
+            results = {name: _read_sync(db, r) for name, r in reads.items()}
+    for result in results.values():
+        fs_op('read', max(1, len(result)) if isinstance(result, list) else 1)
+    return results
+
 # --------------------------------------------------------------------------
 # 2. KULLANICI YÖNETİMİ, GÜVENLİK VE MAİL FONKSİYONLARI
 # --------------------------------------------------------------------------
@@ -292,114 +744,378 @@ def generate_random_password(length=8):
     characters = string.ascii_letters + string.digits
     return ''.join(random.choice(characters) for i in range(length))
 
-def send_email(to_email, subject, body):
-    """SMTP ile e-posta gönderir."""
-    try:
-        # Secrets kontrolü
-        if "email" not in st.secrets:
-            return False, "Secrets dosyasında [email] bölümü eksik."
-            
-        gmail_user = st.secrets["email"]["gmail_user"]
-        gmail_password = st.secrets["email"]["gmail_password"]
+# --- E-POSTA KUYRUĞU ---
+MAIL_QUEUE_SIZE = 200       # Kuyruk dolarsa yeni istekler reddedilir
+MAIL_MAX_RETRIES = 3
+MAIL_IDLE_TIMEOUT = 60      # sn; bu süre boş kalan SMTP bağlantısı kapatılır
+MAIL_NOOP_AFTER = 10        # sn; bağlantı bu süreden uzun boştaysa NOOP ile yoklanır
+MAIL_STATUS_KEEP = 500      # Durumu saklanan en fazla iş sayısı
+MAIL_BULK_PUT_TIMEOUT = 60  # sn; toplu gönderimde kuyrukta yer açılması için beklenen süre
+
+class MailQueue:
+    """Arka planda tek bir iş parçacığıyla e-posta gönderen sınırlı kuyruk.
+
+    Kimliği doğrulanmış SMTP bağlantısı işler arasında yeniden kullanılır,
+    geçici hatalarda yeniden denenir. `settings` sözlüğü secrets'taki [email]
+    bölümüdür: gmail_user, gmail_password ve isteğe bağlı smtp_host,
+    smtp_port, smtp_starttls. Yerel bir SMTP test sunucusu için
+    smtp_starttls=false ve boş şifre verilebilir.
+    """
+
+    def __init__(self, settings, maxsize=MAIL_QUEUE_SIZE, max_retries=MAIL_MAX_RETRIES, idle_timeout=MAIL_IDLE_TIMEOUT):
+        self.settings = settings
+        self.max_retries = max_retries
+        self.idle_timeout = idle_timeout
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._server = None
+        self._last_used = 0.0
+        self._thread = threading.Thread(target=self._run, name="mail-worker", daemon=True)
+        self._thread.start()
+
+    def submit(self, to_email, subject, body, timeout=None):
+        """Maili kuyruğa ekler: (True, iş no) veya (False, hata).
+
+        timeout verilmezse kuyruk doluyken hemen QUEUE_FULL döner; verilirse
+        yer açılması için en fazla o kadar saniye beklenir.
+        """
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._jobs[job_id] = {"status": "queued", "attempts": 0, "error": None, "to": to_email, "created": datetime.now()}
+            while len(self._jobs) > MAIL_STATUS_KEEP:
+                self._jobs.popitem(last=False)
+        try:
+            self._queue.put((job_id, to_email, subject, body), block=timeout is not None, timeout=timeout)
+        except queue.Full:
+            self._update(job_id, status="failed", error="QUEUE_FULL")
+            return False, "QUEUE_FULL"
+        return True, job_id
+
+    def status(self, job_id):
+        """İşin durumunu döner (queued / sending / sent / failed) ya da None."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
 
+    def pending_count(self):
+        return self._queue.qsize()
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields)
+
+    def _connect(self):
+        cfg = self.settings
+        server = smtplib.SMTP(cfg.get("smtp_host", "smtp.gmail.com"), int(cfg.get("smtp_port", 587)), timeout=30)
+        server.ehlo()
+        if cfg.get("smtp_starttls", True):
+            server.starttls()
+            server.ehlo()
+        if cfg.get("gmail_password"):
+            server.login(cfg.get("gmail_user", ""), cfg["gmail_password"])
+        return server
+
+    def _get_server(self):
+        """Açık bağlantıyı döner; kopmuşsa yeniden bağlanır."""
+        if self._server is not None and time.monotonic() - self._last_used > MAIL_NOOP_AFTER:
+            try:
+                if self._server.noop()[0] != 250:
+                    self._close()
+            except (smtplib.SMTPException, OSError):
+                self._close()
+        if self._server is None:
+            self._server = self._connect()
+        return self._server
+
+    def _close(self):
+        if self._server is None: return
+        try:
+            self._server.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+        self._server = None
+
+    def _run(self):
+        while True:
+            try:
+                job = self._queue.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                self._close()
+                continue
+            try:
+                self._deliver(*job)
+            except Exception as e:
+                # Beklenmeyen hata (ayar, kodlama vb.) tek worker'ı durdurmamalı
+                self._close()
+                self._update(job[0], status="failed", error=str(e))
+            finally:
+                self._queue.task_done()
+
+    def _deliver(self, job_id, to_email, subject, body):
+        sender = self.settings.get("gmail_user", "")
         msg = MIMEMultipart()
-        msg['From'] = gmail_user
+        msg['From'] = sender
         msg['To'] = to_email
         msg['Subject'] = subject
         msg.attach(MIMEText(body, 'plain'))
-
-        # SMTP Bağlantısı
-        server = smtplib.SMTP('smtp.gmail.com', 587)
-        server.ehlo() # Sunucuyu selamla
-        server.starttls() # Güvenli bağlantıyı başlat
-        server.ehlo()
-        server.login(gmail_user, gmail_password)
         text = msg.as_string()
-        server.sendmail(gmail_user, to_email, text)
-        server.quit()
-        return True, None
+
+        for attempt in range(1, self.max_retries + 1):
+            self._update(job_id, status="sending", attempts=attempt)
+            try:
+                self._get_server().sendmail(sender, to_email, text)
+                self._last_used = time.monotonic()
+                self._update(job_id, status="sent", error=None)
+                return
+            except (smtplib.SMTPRecipientsRefused, smtplib.SMTPAuthenticationError) as e:
+                # Kalıcı hatalar: yeniden denemek sonucu değiştirmez
+                self._close()
+                self._update(job_id, status="failed", error=str(e))
+                return
+            except (smtplib.SMTPException, OSError) as e:
+                self._close()
+                self._update(job_id, error=str(e))
+                if attempt < self.max_retries:
+                    time.sleep(2 ** attempt)
+        self._update(job_id, status="failed")
+
+@st.cache_resource
+def get_mail_queue():
+    """Süreç genelinde tek e-posta kuyruğu (yeniden çalıştırmalarda korunur)."""
+    return MailQueue(dict(st.secrets["email"]))
+
+def send_email(to_email, subject, body, timeout=None):
+    """E-postayı arka plan kuyruğuna ekler; (başarılı mı, iş no veya hata) döner."""
+    try:
+        # Secrets kontrolü
+        if "email" not in st.secrets:
+            return False, "Secrets dosyasında [email] bölümü eksik."
+        return get_mail_queue().submit(to_email, subject, body, timeout)
     except Exception as e:
         return False, str(e)
 
+def get_email_status(job_id):
+    """Kuyruktaki bir e-posta işinin durumunu döner."""
+    try:
+        return get_mail_queue().status(job_id)
+    except Exception:
+        return None
+
 def reset_password_flow(email):
-    """E-posta adresine göre şifre sıfırlar ve mail atar."""
+    """E-posta adresine göre şifre sıfırlar ve maili kuyruğa ekler.
+
+    Başarılıysa (True, mail iş no) döner; gönderim arka planda sürer.
+    """
     if not db: return False, "DB_ERR"
     
-    # E-posta ile kullanıcıyı bul
-    users_ref = db.collection('users')
-    query = users_ref.where('email', '==', email).stream()
+    # E-posta indeksinden kullanıcıyı bul (tek doküman okuması)
+    username = find_username_by_email(email)
     
-    found_user_doc = None
-    for doc in query:
-        found_user_doc = doc
-        break
-    
-    if found_user_doc:
+    if username:
         new_temp_pass = generate_random_password()
-        username = found_user_doc.id # Document ID kullanıcı adıdır
         
-        # Veritabanını güncelle
-        update_password(username, new_temp_pass)
+        # Veritabanını güncelle (indeks eski bir kullanıcıyı gösteriyorsa update başarısız olur)
+        if not update_password(username, new_temp_pass):
+            return False, "USER_NOT_FOUND"
         
         # Mail gönder
         subject = "Kalıp Kontrol Sistemi - Şifre Sıfırlama / Password Reset"
         body = f"Merhaba,\n\nKullanıcı Adınız: {username}\nYeni Şifreniz: {new_temp_pass}\n\nLütfen giriş yaptıktan sonra şifrenizi değiştirin.\n\nHello,\n\nUsername: {username}\nNew Password: {new_temp_pass}\n\nPlease change your password after login."
         
-        success, err_msg = send_email(email, subject, body)
+        success, result = send_email(email, subject, body)
         if success:
-            return True, "SUCCESS"
+            return True, result
         else:
-            return False, f"MAIL_ERR: {err_msg}"
+            return False, f"MAIL_ERR: {result}"
     else:
         return False, "USER_NOT_FOUND"
 
+# --- E-POSTA İNDEKSİ ---
+# user_emails/{normalize edilmiş e-posta} -> {'username', 'email'}
+# Kullanıcı dokümanlarıyla aynı transaction içinde güncellenir; böylece
+# şifre sıfırlama tek doküman okumasına iner ve aynı e-posta iki kez kullanılamaz.
+EMAIL_INDEX_COLLECTION = 'user_emails'
+
+def normalize_email(email):
+    """E-postayı indeks anahtarına çevirir (boşluksuz, küçük harf)."""
+    if not isinstance(email, str): return ""
+    return email.strip().lower()
+
+def _email_index_ref(email):
+    """E-postanın indeks dokümanı; e-posta boş veya doküman adı olamıyorsa None."""
+    key = normalize_email(email)
+    if not key or "/" in key or key in (".", ".."): return None
+    return db.collection(EMAIL_INDEX_COLLECTION).document(key)
+
+def _read_email_change(transaction, username, old_email, new_email):
+    """E-posta değişikliği için gerekli indeks okumalarını yapar (yazmalardan önce çağrılmalı).
+
+    (uygun mu, silinecek eski indeks ref'i, yazılacak yeni indeks ref'i) döner.
+    """
+    new_ref = _email_index_ref(new_email)
+    old_ref = _email_index_ref(old_email)
+    if old_ref is not None and new_ref is not None and old_ref.id == new_ref.id:
+        old_ref = None
+    if new_ref is not None:
+        snap = new_ref.get(transaction=transaction); fs_op('read')
+        if snap.exists and snap.to_dict().get('username') != username:
+            return False, None, None
+    if old_ref is not None:
+        snap = old_ref.get(transaction=transaction); fs_op('read')
+        # Eski kayıt başka kullanıcıya aitse (eski mükerrer veri) dokunma
+        if not snap.exists or snap.to_dict().get('username') != username:
+            old_ref = None
+    return True, old_ref, new_ref
+
+def _write_email_change(transaction, username, new_email, old_ref, new_ref):
+    if old_ref is not None:
+        transaction.delete(old_ref); fs_op('write')
+    if new_ref is not None:
+        transaction.set(new_ref, {'username': username, 'email': new_email}); fs_op('write')
+
+@firestore.transactional
+def _create_user_txn(transaction, username, user_data, create_only=False):
+    user_ref = db.collection('users').document(username)
+    snap = user_ref.get(transaction=transaction); fs_op('read')
+    if create_only and snap.exists: return "USER_EXISTS"
+    old_email = snap.to_dict().get('email') if snap.exists else None
+    ok, old_ref, new_ref = _read_email_change(transaction, username, old_email, user_data['email'])
+    if not ok: return "EMAIL_TAKEN"
+    transaction.set(user_ref, user_data); fs_op('write')
+    _write_email_change(transaction, username, user_data['email'], old_ref, new_ref)
+    return "SUCCESS"
+
+@firestore.transactional
+def _delete_user_txn(transaction, username):
+    user_ref = db.collection('users').document(username)
+    snap = user_ref.get(transaction=transaction); fs_op('read')
+    if not snap.exists: return "USER_NOT_FOUND"
+    _, old_ref, _ = _read_email_change(transaction, username, snap.to_dict().get('email'), None)
+    transaction.delete(user_ref); fs_op('write')
+    _write_email_change(transaction, username, None, old_ref, None)
+    return "SUCCESS"
+
+@firestore.transactional
+def _update_email_txn(transaction, username, new_email):
+    user_ref = db.collection('users').document(username)
+    snap = user_ref.get(transaction=transaction); fs_op('read')
+    if not snap.exists: return "USER_NOT_FOUND"
+    ok, old_ref, new_ref = _read_email_change(transaction, username, snap.to_dict().get('email'), new_email)
+    if not ok: return "EMAIL_TAKEN"
+    transaction.update(user_ref, {'email': new_email}); fs_op('write')
+    _write_email_change(transaction, username, new_email, old_ref, new_ref)
+    return "SUCCESS"
+
+def find_username_by_email(email):
+    """E-postaya ait kullanıcı adını indeksten bulur; yoksa None."""
+    ref = _email_index_ref(email)
+    if ref is None: return None
+    snap = ref.get(field_paths=['username']); fs_op('read')
+    if snap.exists:
+        return snap.to_dict().get('username')
+    return None
+
+def backfill_email_index():
+    """İndeksten önce oluşturulmuş kullanıcıları user_emails'e ekler; eklenen sayısını döner.
+
+    Mevcut indeks kayıtlarına dokunulmaz; aynı e-postayı (büyük/küçük harf farkıyla)
+    paylaşan eski kullanıcılardan sadece ilki eklenir.
+    """
+    users = {}
+    for doc in db.collection('users').select(['email']).stream():
+        fs_op('read')
+        ref = _email_index_ref(doc.to_dict().get('email'))
+        if ref is not None and ref.id not in users:
+            users[ref.id] = (ref, doc.id, doc.to_dict().get('email'))
+    added = 0
+    for chunk in _chunked(list(users.values()), BULK_CHUNK_SIZE):
+        batch = db.batch(); n = 0
+        for snap in db.get_all([ref for ref, _, _ in chunk], field_paths=['username']):
+            fs_op('read')
+            if snap.exists: continue
+            _, username, email = next(c for c in chunk if c[0].id == snap.id)
+            batch.create(snap.reference, {'username': username, 'email': email}); n += 1
+        if n:
+            batch.commit(); fs_op('write', n); added += n
+    db.collection('settings').document('migrations').set({'email_index': datetime.now()}, merge=True); fs_op('write')
+    return added
+
+@st.cache_resource
+def _ensure_email_index():
+    """Süreç başına bir kez: indeks doldurulmamışsa doldurur."""
+    try:
+        marker = db.collection('settings').document('migrations').get(field_paths=['email_index']); fs_op('read')
+        if not (marker.exists and marker.to_dict().get('email_index')):
+            backfill_email_index()
+        return True
+    except Exception:
+        logging.getLogger("kalip.users").exception("email index backfill failed")
+        return False
+
 def init_users_db():
     """Eğer veritabanında kullanıcı tablosu yoksa varsayılan admin oluşturur."""
     if db:
         users_ref = db.collection('users')
-        docs = users_ref.limit(1).stream()
+        docs = users_ref.limit(1).stream(); fs_op('read')
         if not any(docs):
-            users_ref.document('admin').set({
-                'username': 'admin',
-                'password': make_hashes('1234'),
-                'role': 'admin',
-                'email': 'admin@example.com' # Varsayılan mail
-            })
+            create_user('admin', '1234', 'admin', 'admin@example.com') # Varsayılan mail
+        if not _ensure_email_index():
+            _ensure_email_index.clear() # bir sonraki çalıştırmada tekrar denenir
 
 def login_user(username, password):
     """Giriş işlemini kontrol eder."""
     if not db: return None, None
     doc_ref = db.collection('users').document(username)
-    doc = doc_ref.get()
+    doc = doc_ref.get(field_paths=['password', 'role']); fs_op('read')
     if doc.exists:
         user_data = doc.to_dict()
         if check_hashes(password, user_data['password']):
             return True, user_data['role']
     return False, None
 
-def create_user(username, password, role, email):
-    """Yeni kullanıcı oluşturur (Email ile)."""
-    if not db: return False
+def create_user(username, password, role, email, create_only=False):
+    """Yeni kullanıcı oluşturur (Email ile).
+
+    create_only=True ise var olan kullanıcının üzerine yazılmaz, USER_EXISTS döner.
+    (başarılı mı, kod) döner; kod SUCCESS, USER_EXISTS, EMAIL_TAKEN, INVALID_EMAIL veya DB_ERR olabilir.
+    """
+    if not db: return False, "DB_ERR"
+    if email and _email_index_ref(email) is None: return False, "INVALID_EMAIL"
     try:
-        db.collection('users').document(username).set({
+        code = _create_user_txn(db.transaction(), username, {
             'username': username,
             'password': make_hashes(password),
             'role': role,
             'email': email
-        })
-        return True
+        }, create_only)
+        if code == "SUCCESS": invalidate_user_directory()
+        return code == "SUCCESS", code
     except:
-        return False
+        return False, "DB_ERR"
 
 def delete_user(username):
-    """Kullanıcı siler."""
+    """Kullanıcıyı ve e-posta indeks kaydını siler."""
     if not db: return False
     try:
-        db.collection('users').document(username).delete()
-        return True
+        ok = _delete_user_txn(db.transaction(), username) == "SUCCESS"
+        if ok: invalidate_user_directory()
+        return ok
     except:
         return False
 
+def update_user_email(username, new_email):
+    """Kullanıcının e-postasını indeksle birlikte günceller; (başarılı mı, kod) döner."""
+    if not db: return False, "DB_ERR"
+    if new_email and _email_index_ref(new_email) is None: return False, "INVALID_EMAIL"
+    try:
+        code = _update_email_txn(db.transaction(), username, new_email)
+        if code == "SUCCESS": invalidate_user_directory()
+        return code == "SUCCESS", code
+    except:
+        return False, "DB_ERR"
+
 def update_password(username, new_password):
     """Kullanıcı şifresini günceller."""
     if not db: return False
@@ -407,26 +1123,213 @@ def update_password(username, new_password):
         db.collection('users').document(username).update({
             'password': make_hashes(new_password)
         })
+        fs_op('write')
         return True
     except:
         return False
 
+# --- KULLANICI DİZİNİ (ÖNBELLEKLİ) ---
+USER_PAGE_SIZE = 50
+USER_DIRECTORY_COLUMNS = ['username', 'role', 'email']
+
+@st.cache_data(ttl=600, show_spinner=False)
+def load_user_directory():
+    """Kullanıcı listesini şifre hash'leri olmadan çeker.
+
+    Sonuç önbellekte tutulur; create_user / delete_user / update_user_email
+    başarılı olduğunda temizlenir. TTL, başka süreçlerden yapılan değişiklikler içindir.
+    """
+    if not db: return pd.DataFrame(columns=USER_DIRECTORY_COLUMNS)
+    rows = fetch(users=query_read('users', fields=USER_DIRECTORY_COLUMNS))['users']
+    for data in rows:
+        data['username'] = data.get('username') or data['id']
+    df = pd.DataFrame(rows, columns=USER_DIRECTORY_COLUMNS)
+    return df.sort_values('username', kind='stable').reset_index(drop=True)
+
+def duplicate_emails():
+    """Aynı e-postayı (büyük/küçük harf farkıyla) paylaşan kullanıcılar: email, kullanıcılar.
+
+    İndeksten önceki kayıtlarda kalan çakışmalardır; indekste sadece biri yer alır.
+    """
+    df = load_user_directory()
+    keys = df['email'].map(normalize_email)
+    df = df[(keys != "") & keys.duplicated(keep=False)].assign(email=keys)
+    return df.groupby('email')['username'].agg(', '.join).reset_index()
+
+def invalidate_user_directory():
+    """Kullanıcı dizini önbelleğini temizler."""
+    load_user_directory.clear()
+
+def filter_user_directory(name_filter="", role_filter=None):
+    """Dizini kullanıcı adı (içerir) ve yetkiye göre süzer."""
+    df = load_user_directory()
+    if name_filter:
+        df = df[df['username'].str.contains(name_filter, case=False, regex=False, na=False)]
+    if role_filter:
+        df = df[df['role'] == role_filter]
+    return df
+
+# --- TOPLU KULLANICI İŞLEMLERİ ---
+BULK_CHUNK_SIZE = 200 # Kullanıcı başına 2 yazma (kullanıcı + e-posta indeksi); Firestore batch sınırı 500
+VALID_ROLES = ("user", "admin")
+EMAIL_PATTERN = re.compile(r"^[^@\s/]+@[^@\s/]+\.[^@\s/]+$")
+IMPORT_COLUMN_ALIASES = {
+    'username': 'username', 'kullanici': 'username', 'kullanıcı': 'username', 'kullanıcı adı': 'username',
+    'role': 'role', 'yetki': 'role',
+    'email': 'email', 'e-mail': 'email', 'e-posta': 'email', 'eposta': 'email',
+    'password': 'password', 'temp_password': 'password', 'sifre': 'password', 'şifre': 'password'
+}
+
+def _chunked(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def read_user_import_file(uploaded_file):
+    """CSV/XLSX kullanıcı listesini okur; sütunlar: username, role, email, (password)."""
+    if uploaded_file.name.lower().endswith('.csv'):
+        df = pd.read_csv(uploaded_file, dtype=str, keep_default_na=False, sep=None, engine='python')
+    else:
+        df = pd.read_excel(uploaded_file, dtype=str).fillna("")
+    df = df.rename(columns=lambda c: IMPORT_COLUMN_ALIASES.get(str(c).strip().lower(), str(c).strip().lower()))
+    for col in ('username', 'role', 'email', 'password'):
+        if col not in df.columns: df[col] = ""
+    return df[['username', 'role', 'email', 'password']].astype(str).apply(lambda c: c.str.strip())
+
+def validate_user_import(df):
+    """Hiçbir şey yazmadan tüm satırları doğrular; (geçerli satırlar, hatalar) döner."""
+    existing = load_user_directory()
+    existing_names = set(existing['username'])
+    existing_emails = set(existing['email'].map(normalize_email)) - {""}
+    seen_names, seen_emails = set(), set()
+    rows, errors = [], []
+    for line_no, r in enumerate(df.to_dict('records'), start=2): # 1. satır başlık
+        problems = []
+        username = r['username']; role = (r['role'] or 'user').lower(); email = r['email']; key = normalize_email(email)
+        if not username or "/" in username: problems.append("INVALID_USERNAME")
+        elif username in existing_names: problems.append("USER_EXISTS")
+        elif username in seen_names: problems.append("DUPLICATE_USERNAME")
+        if role not in VALID_ROLES: problems.append("INVALID_ROLE")
+        if not EMAIL_PATTERN.match(email): problems.append("INVALID_EMAIL")
+        elif key in existing_emails: problems.append("EMAIL_TAKEN")
+        elif key in seen_emails: problems.append("DUPLICATE_EMAIL")
+        if problems:
+            errors.append({"satir": line_no, "username": username, "email": email, "hata": ", ".join(problems)})
+            continue
+        seen_names.add(username); seen_emails.add(key)
+        rows.append({"username": username, "role": role, "email": email, "password": r['password'] or generate_random_password()})
+    return rows, errors
+
+def _credentials_mail(username, password):
+    subject = "Kalıp Kontrol Sistemi - Hesap Bilgileri / Account Details"
+    body = f"Merhaba,\n\nKullanıcı Adınız: {username}\nGeçici Şifreniz: {password}\n\nLütfen giriş yaptıktan sonra şifrenizi değiştirin.\n\nHello,\n\nUsername: {username}\nTemporary Password: {password}\n\nPlease change your password after login."
+    return subject, body
+
+def bulk_create_users(rows, send_credentials=False):
+    """Doğrulanmış satırları parça parça batch ile yazar.
+
+    batch.create var olan dokümanda hata verdiği için e-posta benzersizliği
+    korunur; çakışan bir parça satır satır create_user(create_only=True) ile
+    yeniden denenir, böylece doğrulamadan sonra eklenen kullanıcı ezilmez.
+    (oluşturulan satırlar, başarısız kullanıcı adları) döner. send_credentials
+    ise her oluşturulan satırın 'mail' alanına kuyruk sonucu (SUCCESS veya hata) yazılır.
+    """
+    if not db: return [], [r['username'] for r in rows]
+    created, failed = [], []
+    for chunk in _chunked(rows, BULK_CHUNK_SIZE):
+        batch = db.batch()
+        for r in chunk:
+            batch.create(db.collection('users').document(r['username']), {
+                'username': r['username'], 'password': make_hashes(r['password']), 'role': r['role'], 'email': r['email']
+            })
+            batch.create(_email_index_ref(r['email']), {'username': r['username'], 'email': r['email']})
+        try:
+            batch.commit(); fs_op('write', 2 * len(chunk))
+            created.extend(chunk)
+        except Exception:
+            for r in chunk:
+                ok, _ = create_user(r['username'], r['password'], r['role'], r['email'], create_only=True)
+                if ok: created.append(r)
+                else: failed.append(r['username'])
+    invalidate_user_directory()
+    if send_credentials:
+        # Kuyruk dolarsa mail atlanmaz; worker yer açana kadar beklenir
+        for r in created:
+            ok, info = send_email(r['email'], *_credentials_mail(r['username'], r['password']), timeout=MAIL_BULK_PUT_TIMEOUT)
+            r['mail'] = "SUCCESS" if ok else info
+    return created, failed
+
+def bulk_update_roles(usernames, role):
+    """Seçili kullanıcıların yetkisini batch'ler halinde günceller."""
+    if not db or role not in VALID_ROLES: return False
+    try:
+        for chunk in _chunked(list(usernames), 500):
+            batch = db.batch()
+            for u in chunk:
+                batch.update(db.collection('users').document(u), {'role': role})
+            batch.commit(); fs_op('write', len(chunk))
+        return True
+    except:
+        return False
+    finally:
+        invalidate_user_directory()
+
+def bulk_delete_users(usernames):
+    """Seçili kullanıcıları e-posta indeks kayıtlarıyla birlikte batch'ler halinde siler."""
+    if not db: return False
+    try:
+        for chunk in _chunked(list(usernames), BULK_CHUNK_SIZE):
+            refs = [db.collection('users').document(u) for u in chunk]
+            batch = db.batch()
+            for snap in db.get_all(refs, field_paths=['email']):
+                fs_op('read')
+                if not snap.exists: continue
+                batch.delete(snap.reference); fs_op('write')
+                idx_ref = _email_index_ref(snap.to_dict().get('email'))
+                if idx_ref is not None: batch.delete(idx_ref); fs_op('write')
+            batch.commit()
+        return True
+    except:
+        return False
+    finally:
+        invalidate_user_directory()
+
 # --- YENİ EKLENEN FONKSİYONLAR: AYARLAR YÖNETİMİ ---
+# Ayarlar CONFIG_TTL sn süreç içinde saklanır; eskidiğinde sayfanın diğer
+# okumalarıyla aynı fetch içinde yenilenir, ayrı bir istek beklenmez.
+DEFAULT_CONFIG = {'tolerance': 0.25}
+CONFIG_FIELDS = ['tolerance', 'tolerance_rules']
+CONFIG_TTL = 60 # sn
+
+@st.cache_resource
+def _config_cache():
+    return {'value': None, 'ts': 0.0}
+
+def invalidate_system_config():
+    _config_cache()['ts'] = 0.0
+
+def fetch_with_config(**reads):
+    """Sayfa okumalarını, gerekiyorsa ayarlarla birlikte tek seferde yapar; (ayarlar, sonuçlar) döner."""
+    cache = _config_cache()
+    if db and (cache['value'] is None or time.time() - cache['ts'] > CONFIG_TTL):
+        reads = {**reads, '_config': doc_read('settings/config', CONFIG_FIELDS)}
+    failed = False
+    try:
+        results = fetch(**reads)
+    except Exception:
+        failed = True
+        results = {name: (None if r['kind'] == 'doc' else []) for name, r in reads.items()}
+    # Okuma başarısızsa önbellek (ve zamanı) korunur; bir sonraki çalıştırma tekrar dener
+    if '_config' in results and failed:
+        results.pop('_config')
+    elif '_config' in results:
+        data = results.pop('_config') or {}; data.pop('id', None)
+        # Eğer DB'de tolerance alanı yoksa varsayılanı kullan
+        cache.update(value={**DEFAULT_CONFIG, **data}, ts=time.time())
+    return dict(cache['value'] or DEFAULT_CONFIG), results
+
 def get_system_config():
     """Sistem ayarlarını (tolerans vb.) çeker."""
-    default_config = {'tolerance': 0.25}
-    if not db: return default_config
-    try:
-        doc = db.collection('settings').document('config').get()
-        if doc.exists:
-            data = doc.to_dict()
-            # Eğer DB'de tolerance alanı yoksa varsayılanı kullan
-            if 'tolerance' not in data:
-                return default_config
-            return data
-        return default_config
-    except:
-        return default_config
+    return fetch_with_config()[0]
 
 def update_system_config(tolerance):
     """Admin tarafından tolerans değerini günceller."""
@@ -435,6 +1338,46 @@ def update_system_config(tolerance):
         db.collection('settings').document('config').set({
             'tolerance': float(tolerance)
         }, merge=True)
+        fs_op('write')
+        invalidate_system_config()
+        return True
+    except:
+        return False
+
+BUSINESS_UNITS = ["BU1", "BU3", "BU5"]
+TOLERANCE_DIMS = ("boy", "en", "cevre") # FARK_COLUMNS ile aynı sırada
+SIZE_RANGE_PATTERN = re.compile(r"^\s*(\d+(?:[.,]\d+)?)\s*-\s*(\d+(?:[.,]\d+)?)\s*$")
+
+def validate_tolerance_rules(rules):
+    """Kural listesini temizler; (kurallar, hatalar) döner.
+
+    Kural: business_unit ('*' veya BU), olcu ('*', boy, en, cevre), bedenler
+    (boş = hepsi, '36-44' aralık veya 'S,M,L' liste) ve tolerans (cm, > 0).
+    """
+    clean, errors = [], []
+    for i, rule in enumerate(rules, start=1):
+        rule = {k: (None if pd.isna(v) else v) for k, v in rule.items()} # tablo düzenleyicinin boş hücreleri
+        bu = str(rule.get('business_unit') or '*').strip()
+        dim = str(rule.get('olcu') or '*').strip().lower()
+        sizes = str(rule.get('bedenler') or '').strip()
+        try:
+            tol = float(rule.get('tolerans'))
+        except (TypeError, ValueError):
+            tol = None
+        if bu != '*' and bu not in BUSINESS_UNITS: errors.append(f"{i}: BU '{bu}'"); continue
+        if dim != '*' and dim not in TOLERANCE_DIMS: errors.append(f"{i}: {dim}"); continue
+        if tol is None or not tol > 0: errors.append(f"{i}: tolerans"); continue
+        if "-" in sizes and not SIZE_RANGE_PATTERN.match(sizes): errors.append(f"{i}: {sizes}"); continue
+        clean.append({'business_unit': bu, 'olcu': dim, 'bedenler': sizes, 'tolerans': tol})
+    return clean, errors
+
+def update_tolerance_rules(rules):
+    """Tolerans kurallarını settings/config'e yazar."""
+    if not db: return False
+    try:
+        db.collection('settings').document('config').set({'tolerance_rules': rules}, merge=True)
+        fs_op('write')
+        invalidate_system_config()
         return True
     except:
         return False
@@ -654,8 +1597,1116 @@ def parse_excel_pp_sheet(df):
         else: idx += 1
     return parts_data
 
+# --- GİRDİ OKUYUCULARI ---
+# Her okuyucu dosyayı bölümlere (Excel sayfası, tüm CSV vb.) ayırır ve her
+# bölümden parse_excel_gerber_sheet / parse_excel_pp_sheet ile aynı
+# {unique_id: {"meta", "df"}} yapısında Gerber ve PP parçaları üretir.
+# Bölümler artımlı analizde ayrı ayrı parmak izlenir.
+#
+# Tablo biçimleri (CSV/TSV/Parquet) satır başına bir ölçü içerir:
+#   kaynak (gerber | pp), parca (ör. L1/MODEL-SEZON-PARCA), beden, boy, en, cevre
+TABULAR_COLUMN_ALIASES = {
+    'kaynak': 'kaynak', 'source': 'kaynak', 'sistem': 'kaynak',
+    'parca': 'parca', 'parça': 'parca', 'part': 'parca', 'header': 'parca',
+    'beden': 'Beden', 'size': 'Beden', 'boyut': 'Beden',
+    'boy': 'boy', 'length': 'boy', 'en': 'en', 'width': 'en',
+    'cevre': 'cevre', 'çevre': 'cevre', 'circumference': 'cevre'
+}
+TEXT_BLOCK_KINDS = {'CEVRE': 'cevre', 'ÇEVRE': 'cevre', 'EN': 'en', 'BOY': 'boy', 'PP': 'pp', 'POLY': 'pp', 'POLYPATTERN': 'pp'}
+
+def _sheet_kind(sheet_name):
+    upper = sheet_name.upper()
+    if "GERBER" in upper: return 'gerber'
+    if "PP" in upper or "POLY" in upper: return 'pp'
+    return None
+
+def tabular_to_parts(df):
+    """Satır başına bir ölçü içeren tabloyu (gerber parçaları, pp parçaları) yapısına çevirir."""
+    df = df.rename(columns=lambda c: TABULAR_COLUMN_ALIASES.get(str(c).strip().lower(), str(c).strip()))
+    missing = {'kaynak', 'parca', 'Beden', 'boy', 'en', 'cevre'} - set(df.columns)
+    if missing: raise ValueError(f"Eksik sütun: {', '.join(sorted(missing))}")
+    df = df[['kaynak', 'parca', 'Beden', 'boy', 'en', 'cevre']].dropna(subset=['parca', 'Beden'])
+    df['Beden'] = df['Beden'].astype(str).str.replace("*", "", regex=False).str.strip()
+    for col in ('boy', 'en', 'cevre'):
+        if not pd.api.types.is_numeric_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col].astype(str).str.replace(',', '.', regex=False), errors='coerce')
+        df[col] = df[col].fillna(0.0).astype('float64')
+    kind = df['kaynak'].astype(str).str.strip().str.upper()
+    df['kaynak'] = kind.map(lambda k: 'pp' if k.startswith(('PP', 'POLY')) else ('gerber' if k.startswith('GERBER') else None))
+
+    gerber_parts, pp_parts = {}, {}
+    for (source, header), g in df.groupby(['kaynak', 'parca'], sort=False):
+        meta = parse_header_info(str(header))
+        if not meta: continue
+        part = g[['Beden', 'boy', 'en', 'cevre']].reset_index(drop=True)
+        if source == 'gerber':
+            df_g = part[['cevre', 'en', 'boy']].abs()
+            df_g.insert(0, 'Beden', part['Beden'])
+            gerber_parts[meta['unique_id']] = {"meta": meta, "df": df_g}
+        else:
+            pp_parts[meta['unique_id']] = {"meta": meta, "df": part.rename(columns={'boy': 'poly_boy', 'en': 'poly_en', 'cevre': 'poly_cevre'})}
+    return gerber_parts, pp_parts
+
+def parse_text_export(text):
+    """Manuel sayfaya yapıştırılan metinlerin dosya hali.
+
+    Her blok '### CEVRE', '### EN', '### BOY' veya '### PP' satırıyla başlar;
+    aynı tür tekrar geldiğinde yeni parça başlar. Parça adı CEVRE bloğunun ilk satırından okunur.
+    """
+    parts, current, kind = [], {}, None
+    for line in text.splitlines():
+        marker = re.match(r"^\s*###\s*(\S+)", line)
+        if marker and marker.group(1).upper() in TEXT_BLOCK_KINDS:
+            kind = TEXT_BLOCK_KINDS[marker.group(1).upper()]
+            if kind in current: parts.append(current); current = {}
+            current[kind] = []
+        elif kind is not None:
+            current[kind].append(line)
+    if current: parts.append(current)
+
+    gerber_parts, pp_parts = {}, {}
+    for blocks in parts:
+        texts = {k: "\n".join(v) for k, v in blocks.items()}
+        if not all(texts.get(k) for k in ('cevre', 'en', 'boy', 'pp')): continue
+        first_line = next((l for l in texts['cevre'].splitlines() if l.strip()), "")
+        meta = parse_header_info(first_line)
+        if not meta: continue
+        dfc = parse_gerber_table(texts['cevre'], 'cevre'); dfe = parse_gerber_table(texts['en'], 'en'); dfb = parse_gerber_table(texts['boy'], 'boy'); dfp = parse_polypattern(texts['pp'])
+        if dfc.empty or dfe.empty or dfb.empty or dfp.empty: continue
+        gerber_parts[meta['unique_id']] = {"meta": meta, "df": dfc.merge(dfe, on="Beden").merge(dfb, on="Beden")}
+        pp_parts[meta['unique_id']] = {"meta": meta, "df": dfp}
+    return gerber_parts, pp_parts
+
+def _sniff_delimiter(data):
+    sample = data[:4096].decode("utf-8", errors="ignore").split("\n", 1)[0]
+    return max(("\t", ";", ","), key=sample.count)
+
+class InputReader(abc.ABC):
+    """Girdi dosyası okuyucusu arayüzü."""
+    extensions = ()
+
+    @abc.abstractmethod
+    def sections(self, data, file_name):
+        """Dosyayı {bölüm adı: ham veri} sözlüğüne ayırır."""
+
+    @abc.abstractmethod
+    def parse_section(self, name, raw):
+        """Bir bölümden (gerber parçaları, pp parçaları) üretir."""
+
+class ExcelReader(InputReader):
+    extensions = ("xlsx",)
+
+    def sections(self, data, file_name):
+        return pd.read_excel(io.BytesIO(data), sheet_name=None, header=None)
+
+    def parse_section(self, name, raw):
+        kind = _sheet_kind(name)
+        if kind == 'gerber': return parse_excel_gerber_sheet(raw), {}
+        if kind == 'pp': return {}, parse_excel_pp_sheet(raw)
+        return {}, {}
+
+class DelimitedReader(InputReader):
+    """CSV/TSV; pyarrow kuruluysa Arrow, değilse pandas C ayrıştırıcısı kullanılır."""
+    extensions = ("csv", "tsv")
+
+    def sections(self, data, file_name):
+        sep = "\t" if file_name.lower().endswith(".tsv") else _sniff_delimiter(data)
+        engine = "pyarrow" if importlib.util.find_spec("pyarrow") else "c"
+        return {file_name: pd.read_csv(io.BytesIO(data), sep=sep, engine=engine)}
+
+    def parse_section(self, name, raw):
+        return tabular_to_parts(raw)
+
+class ParquetReader(InputReader):
+    extensions = ("parquet",)
+
+    def sections(self, data, file_name):
+        return {file_name: pd.read_parquet(io.BytesIO(data))}
+
+    def parse_section(self, name, raw):
+        return tabular_to_parts(raw)
+
+class TextReader(InputReader):
+    extensions = ("txt",)
+
+    def sections(self, data, file_name):
+        return {file_name: data.decode("utf-8", errors="replace")}
+
+    def parse_section(self, name, raw):
+        return parse_text_export(raw)
+
+INPUT_READERS = {}
+
+def register_reader(reader):
+    for ext in reader.extensions:
+        INPUT_READERS[ext] = reader
+
+for _reader in (ExcelReader(), DelimitedReader(), ParquetReader(), TextReader()):
+    register_reader(_reader)
+
+def get_reader(file_name):
+    """Dosya uzantısına göre okuyucuyu döner."""
+    ext = os.path.splitext(file_name)[1].lstrip(".").lower()
+    if ext not in INPUT_READERS: raise ValueError(f"Desteklenmeyen dosya türü: .{ext}")
+    return INPUT_READERS[ext]
+
 # --------------------------------------------------------------------------
-# 5. SAYFA DÜZENİ VE AKIŞ
+# 5. ANALİZ, SONUÇ DEPOSU VE KAYIT İŞLEMLERİ
+# --------------------------------------------------------------------------
+
+# Analiz sonuçları session_state yerine süreç genelindeki bu depoda tutulur.
+# Bellek bütçesi aşılınca tüm oturumlar arasında en uzun süredir kullanılmayan
+# kayıtlar diske taşınır ve tekrar istendiğinde geri yüklenir.
+RESULT_STORE_BUDGET_MB = float(os.environ.get("KALIP_RESULT_BUDGET_MB", 256))
+RESULT_SPILL_DIR = os.environ.get("KALIP_SPILL_DIR", os.path.join(".kalip_cache", "results"))
+RESULT_SPILL_MAX_AGE = 24 * 3600 # sn; terk edilmiş oturumların dosyaları bu süre sonra silinir
+RESULT_COLUMNS = ['Beden', 'boy', 'poly_boy', 'en', 'poly_en', 'cevre', 'poly_cevre', 'Fark_Boy', 'Fark_En', 'Fark_Cevre']
+FARK_COLUMNS = ['Fark_Boy', 'Fark_En', 'Fark_Cevre']
+
+def compact_part_df(df):
+    """Sonuç tablosunu sadece gereken sütunlarla, kategorik beden ve float32 olarak döner."""
+    cols = [c for c in RESULT_COLUMNS if c in df.columns]
+    out = df[cols].reset_index(drop=True)
+    out['Beden'] = out['Beden'].astype(str).astype('category')
+    num_cols = [c for c in cols if c != 'Beden']
+    out[num_cols] = out[num_cols].astype('float32')
+    return out
+
+def fark_values(df):
+    """Fark sütunlarını float64'e çevirip yuvarlar (float32 gürültüsü tolerans sınırını bozmasın)."""
+    return df[FARK_COLUMNS].astype('float64').round(4)
+
+def _estimate_size(obj):
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        return int(obj.memory_usage(deep=True).sum()) if isinstance(obj, pd.DataFrame) else int(obj.memory_usage(deep=True))
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(_estimate_size(v) for v in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sys.getsizeof(obj) + sum(_estimate_size(v) for v in obj)
+    return sys.getsizeof(obj)
+
+class ResultStore:
+    """Bayt bütçeli, LRU sıralı ve diske taşabilen anahtar/değer deposu."""
+
+    def __init__(self, budget_bytes, spill_dir):
+        self.budget = budget_bytes
+        self.spill_dir = spill_dir
+        self._mem = OrderedDict() # anahtar -> (nesne, boyut)
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self._last_purge = 0.0
+        os.makedirs(spill_dir, exist_ok=True)
+        self._purge_old()
+
+    def _path(self, key):
+        return os.path.join(self.spill_dir, hashlib.sha1(key.encode()).hexdigest() + ".pkl")
+
+    def put(self, key, obj):
+        with self._lock:
+            self._discard(key)
+            size = _estimate_size(obj)
+            self._mem[key] = (obj, size)
+            self._bytes += size
+            self._evict()
+            if time.time() - self._last_purge > 3600: self._purge_old()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._mem:
+                self._mem.move_to_end(key)
+                return self._mem[key][0]
+            path = self._path(key)
+            try:
+                with open(path, "rb") as f:
+                    obj = pickle.load(f)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                return default
+            os.remove(path)
+            size = _estimate_size(obj)
+            self._mem[key] = (obj, size)
+            self._bytes += size
+            self._evict()
+            return obj
+
+    def delete(self, key):
+        with self._lock:
+            self._discard(key)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._mem), 'mb': round(self._bytes / 2**20, 1), 'spilled': len(os.listdir(self.spill_dir))}
+
+    def _discard(self, key):
+        if key in self._mem:
+            self._bytes -= self._mem.pop(key)[1]
+        with contextlib.suppress(OSError):
+            os.remove(self._path(key))
+
+    def _evict(self):
+        # En son eklenen/kullanılan kayıt bütçeyi tek başına aşsa bile bellekte kalır
+        while self._bytes > self.budget and len(self._mem) > 1:
+            key, (obj, size) = self._mem.popitem(last=False)
+            self._bytes -= size
+            tmp = self._path(key) + ".tmp"
+            with open(tmp, "wb") as f:
+                pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self._path(key))
+
+    def _purge_old(self):
+        self._last_purge = time.time()
+        for name in os.listdir(self.spill_dir):
+            path = os.path.join(self.spill_dir, name)
+            with contextlib.suppress(OSError):
+                if self._last_purge - os.path.getmtime(path) > RESULT_SPILL_MAX_AGE: os.remove(path)
+
+@st.cache_resource
+def get_result_store():
+    return ResultStore(int(RESULT_STORE_BUDGET_MB * 2**20), RESULT_SPILL_DIR)
+
+def session_uid():
+    """Oturumu süreç genelindeki depolarda ayırt eden kimlik."""
+    return st.session_state.setdefault('session_uid', uuid.uuid4().hex)
+
+def get_session_result(name, default=None):
+    return get_result_store().get(f"{session_uid()}:{name}", default)
+
+def set_session_result(name, obj):
+    get_result_store().put(f"{session_uid()}:{name}", obj)
+
+def clear_session_result(name):
+    get_result_store().delete(f"{session_uid()}:{name}")
+
+# --- ARTIMLI EXCEL ANALİZİ ---
+# Her sayfanın ve her parça bloğunun (unique_id + satırlar) parmak izi tutulur.
+# Aynı dosya düzeltilip tekrar yüklendiğinde değişmeyen sayfalar yeniden
+# ayrıştırılmaz, değişmeyen parçaların karşılaştırma sonuçları yeniden kullanılır.
+
+def _fingerprint_section(raw):
+    if isinstance(raw, str):
+        return hashlib.sha1(raw.encode()).hexdigest()
+    h = hashlib.sha1(repr((raw.shape, list(raw.columns))).encode())
+    h.update(pd.util.hash_pandas_object(raw.astype(str), index=True).values.tobytes())
+    return h.hexdigest()
+
+def _fingerprint_part(unique_id, df_g, df_p):
+    h = hashlib.sha1(unique_id.encode())
+    for df in (df_g, df_p):
+        h.update(repr(list(df.columns)).encode())
+        h.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return h.hexdigest()
+
+def compare_part(df_g, df_p):
+    """Gerber ve Polypattern tablolarını bedene göre birleştirip farkları hesaplar."""
+    df_final = df_g.merge(df_p, on="Beden", how="inner")
+    df_final['Fark_Boy'] = df_final['boy'] - df_final['poly_boy']
+    df_final['Fark_En'] = df_final['en'] - df_final['poly_en']
+    df_final['Fark_Cevre'] = df_final['cevre'] - df_final['poly_cevre']
+    return compact_part_df(df_final)
+
+def group_results(parts_state, changes=None):
+    """Parça durumlarını model (sezon) bazında gruplar."""
+    status_of = {uid: status for status in ('added', 'changed', 'unchanged') for uid in (changes or {}).get(status, [])}
+    grouped = {}
+    for uid, part in parts_state.items():
+        meta = part['meta']
+        model_key = f"{meta['model']} ({meta['season']})"
+        if model_key not in grouped:
+            grouped[model_key] = {"model": meta['model'], "season": meta['season'], "parts": []}
+        grouped[model_key]["parts"].append({"parca_adi": meta['part'], "df": part['df'], "unique_id": uid, "change": status_of.get(uid, 'added')})
+    return grouped
+
+def analyze_sections(sections, reader, prev=None, progress=None):
+    """Okuyucunun ürettiği ham bölümleri ({ad: veri}) ayrıştırıp karşılaştırır.
+
+    prev, önceki çağrının döndürdüğü durumdur; değişmeyen bölüm ve parçalar
+    ondan alınır. progress(oran, mesaj, ara sonuç) verilirse her bölümden ve
+    her parçadan sonra çağrılır. (gruplanmış sonuçlar, yeni durum, değişiklik özeti) döner.
+    """
+    prev = prev or {'sheets': {}, 'parts': {}}
+    state = {'sheets': {}, 'parts': {}}
+    all_gerber_parts, all_pp_parts = {}, {}
+    progress = progress or (lambda *args: None)
+    for sheet_no, (name, raw) in enumerate(sections.items(), start=1):
+        fp = _fingerprint_section(raw)
+        cached = prev['sheets'].get(name)
+        if cached and cached['fp'] == fp:
+            gerber_parts, pp_parts = cached['gerber'], cached['pp']
+        else:
+            with perf_stage(f"parse:{name}"):
+                gerber_parts, pp_parts = reader.parse_section(name, raw)
+        if not (gerber_parts or pp_parts): continue
+        state['sheets'][name] = {'fp': fp, 'gerber': gerber_parts, 'pp': pp_parts}
+        all_gerber_parts.update(gerber_parts); all_pp_parts.update(pp_parts)
+        progress(0.5 * sheet_no / len(sections), name, {'sheets': list(state['sheets']), 'parts': 0})
+
+    if not all_gerber_parts: raise ValueError("Gerber?")
+    if not all_pp_parts: raise ValueError("Polypattern?")
+
+    changes = {'added': [], 'changed': [], 'unchanged': [], 'removed': []}
+    with perf_stage("merge"):
+        for part_no, (unique_id, pp_data) in enumerate(all_pp_parts.items(), start=1):
+            progress(0.5 + 0.5 * part_no / len(all_pp_parts), unique_id, {'sheets': list(state['sheets']), 'parts': len(state['parts'])})
+            if unique_id not in all_gerber_parts: continue
+            df_g = all_gerber_parts[unique_id]['df']; df_p = pp_data['df']
+            fp = _fingerprint_part(unique_id, df_g, df_p)
+            old = prev['parts'].get(unique_id)
+            if old and old['fp'] == fp:
+                df_final = old['df']; status = 'unchanged'
+            else:
+                try:
+                    df_final = compare_part(df_g, df_p)
+                except Exception:
+                    continue
+                status = 'changed' if old else 'added'
+            state['parts'][unique_id] = {'fp': fp, 'meta': pp_data['meta'], 'df': df_final}
+            changes[status].append(unique_id)
+    changes['removed'] = [uid for uid in prev['parts'] if uid not in state['parts']]
+    return group_results(state['parts'], changes), state, changes
+
+# --- MANUEL GİRİŞ ANALİZİ ---
+MANUAL_MAX_SLOTS = 100
+
+@st.cache_data(max_entries=1000, show_spinner=False)
+def analyze_manual_slot(gc, ge, gb, pp):
+    """Bir parçanın yapıştırılan dört metnini ayrıştırıp karşılaştırır.
+
+    Sonuç metinlerin özetine göre önbelleklenir; aynı metin tekrar ayrıştırılmaz.
+    Tablolardan biri okunamazsa None döner.
+    """
+    dfc = parse_gerber_table(gc,'cevre'); dfe = parse_gerber_table(ge,'en'); dfb = parse_gerber_table(gb,'boy'); dfp = parse_polypattern(pp)
+    if dfc.empty or dfe.empty or dfb.empty or dfp.empty: return None
+    dft = dfc.merge(dfe, on="Beden").merge(dfb, on="Beden"); dff = dft.merge(dfp, on="Beden")
+    dff['Fark_Boy']=dff['boy']-dff['poly_boy']; dff['Fark_En']=dff['en']-dff['poly_en']; dff['Fark_Cevre']=dff['cevre']-dff['poly_cevre']
+    return {"df": dff, "meta": parse_gerber_metadata(gc)}
+
+def update_manual_results(inputs, slot_count, business_unit, t):
+    """Dolu parçaları analiz eder; metni değişmemiş parçaların sonucuna dokunmaz.
+
+    Listeye eklenmiş parçalar metin özetiyle tutulur; metin sonradan
+    değiştirilip eski haline getirilse de kaydedilmiş sayılır.
+    """
+    results = st.session_state.setdefault('analysis_results', {})
+    saved_hashes = st.session_state.setdefault('manual_saved_hashes', set())
+    for i in [i for i in results if i >= slot_count]:
+        del results[i]
+    for i in range(slot_count):
+        gc=inputs[f"g_c_{i}"]; ge=inputs[f"g_e_{i}"]; gb=inputs[f"g_b_{i}"]; pp=inputs[f"poly_{i}"]
+        if not (gc and ge and gb and pp):
+            results.pop(i, None); continue
+        text_hash = hashlib.sha1("\x00".join((gc, ge, gb, pp)).encode()).hexdigest()
+        if i in results and results[i].get('hash') == text_hash: continue
+        if 'active_session' not in st.session_state:
+            meta = parse_gerber_metadata(gc)
+            if meta: st.session_state['active_session']=True; st.session_state['current_model']={"model_adi":meta['model_adi'],"sezon":meta['sezon'],"bu":business_unit}
+        try:
+            with perf_stage("manual_parse"):
+                res = analyze_manual_slot(gc, ge, gb, pp)
+        except Exception:
+            st.error(f"{t['part']} {i+1} Err"); results.pop(i, None); continue
+        if res is None:
+            results.pop(i, None); continue
+        pname = res['meta']['parca_adi'] if res['meta'] else f"{t['part']} {i+1}"
+        results[i] = {"df": res['df'], "parca_adi": pname, "saved": text_hash in saved_hashes, "hash": text_hash}
+
+# --- ARKA PLAN ANALİZ İŞLERİ ---
+# Ağır analizler script iş parçacığında değil, süreç içi bir iş havuzunda
+# çalışır; sayfa iş numarasıyla durumu ve ara sonuçları yoklar. Harici bir
+# kuyruk sunucusu gerekmez. pandas/openpyxl iş parçacıkları arasında GIL'i
+# paylaştığından havuz küçük tutulur; amaç oturumları bloklamamaktır.
+JOB_WORKERS = int(os.environ.get("KALIP_JOB_WORKERS", 2))
+JOB_PER_USER_LIMIT = 2
+JOB_KEEP_SECONDS = 3600 # sn; alınmamış sonuçlar bu süre sonra silinir
+JOB_POLL_SECONDS = 1.5
+
+class JobCancelled(Exception):
+    pass
+
+class Job:
+    """Tek bir arka plan işinin durumu; worker iş parçacığı tarafından güncellenir."""
+
+    def __init__(self, user, label):
+        self.id = uuid.uuid4().hex
+        self.user = user
+        self.label = label
+        self.status = 'queued' # queued / running / done / failed / cancelled
+        self.progress = 0.0
+        self.message = ""
+        self.partial = {}
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.future = None
+        # Gönderen çalıştırmada ölçüm açıksa worker aşamaları buraya yazar
+        self.perf = PerfRun() if getattr(_perf_local, 'run', None) is not None else None
+        self._cancel = threading.Event()
+
+    def report(self, progress, message="", partial=None):
+        """İlerlemeyi bildirir; iptal istenmişse JobCancelled fırlatır."""
+        if self._cancel.is_set(): raise JobCancelled()
+        self.progress = min(max(progress, 0.0), 1.0)
+        self.message = message
+        if partial is not None: self.partial = partial
+
+    @property
+    def active(self):
+        return self.status in ('queued', 'running')
+
+class JobManager:
+    """Kullanıcı başına eşzamanlılık sınırı olan süreç içi iş havuzu."""
+
+    def __init__(self, workers=JOB_WORKERS, per_user_limit=JOB_PER_USER_LIMIT):
+        self.per_user_limit = per_user_limit
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="analysis")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, user, label, fn, *args):
+        """fn(job, *args) işini kuyruğa ekler; kullanıcı sınırı doluysa None döner."""
+        with self._lock:
+            self._prune()
+            if sum(1 for j in self._jobs.values() if j.user == user and j.active) >= self.per_user_limit:
+                return None
+            job = Job(user, label)
+            self._jobs[job.id] = job
+        job.future = self._executor.submit(self._run, job, fn, args)
+        return job.id
+
+    def get(self, job_id, user):
+        job = self._jobs.get(job_id)
+        return job if job is not None and job.user == user else None
+
+    def cancel(self, job_id, user):
+        job = self.get(job_id, user)
+        if job is None or not job.active: return False
+        job._cancel.set()
+        if job.future is not None and job.future.cancel():
+            job.status = 'cancelled'; job.finished = time.time()
+        return True
+
+    def forget(self, job_id):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def cancel_user(self, user):
+        """Kullanıcının tüm işlerini iptal edip unutur (çıkışta); sınırdan düşülürler."""
+        with self._lock:
+            job_ids = [j.id for j in self._jobs.values() if j.user == user]
+        for job_id in job_ids:
+            self.cancel(job_id, user)
+            self.forget(job_id)
+
+    def _run(self, job, fn, args):
+        if job._cancel.is_set():
+            job.status = 'cancelled'; job.finished = time.time(); return
+        job.status = 'running'
+        _perf_local.run = job.perf
+        try:
+            job.result = fn(job, *args)
+            job.progress = 1.0
+            job.status = 'done'
+        except JobCancelled:
+            job.status = 'cancelled'
+        except Exception as e:
+            job.error = str(e)
+            job.status = 'failed'
+        finally:
+            _perf_local.run = None
+            job.finished = time.time()
+
+    def _prune(self):
+        now = time.time()
+        for job_id in [j.id for j in self._jobs.values() if j.finished and now - j.finished > JOB_KEEP_SECONDS]:
+            del self._jobs[job_id]
+
+@st.cache_resource
+def get_job_manager():
+    return JobManager()
+
+def file_analysis_job(job, data, file_name, prev, file_fp):
+    """Yüklenen dosyayı uygun okuyucuyla okuyup analiz eden arka plan işi."""
+    reader = get_reader(file_name)
+    job.report(0.0, f"read:{file_name}")
+    sections = reader.sections(data, file_name)
+    grouped, state, changes = analyze_sections(sections, reader, prev, progress=job.report)
+    state['file_fp'] = file_fp
+    return grouped, state, changes if prev else None
+
+# --- TOLERANS KURALLARI ---
+# settings/config.tolerance varsayılan sınırdır; tolerance_rules bunu BU, ölçü
+# ve beden bazında değiştirir. Birden fazla kural eşleşirse en özel olan
+# (BU > beden > ölçü) kazanır, eşitlikte listede sonra gelen. Kurallar bir kez
+# derlenir; değerlendirme, satırların (BU, beden) çiftlerini kategorilere ayırıp
+# her çift için bir kez hesaplanan sınır tablosundan dizi indeksiyle yapılır.
+
+class ToleranceRules:
+    """Derlenmiş tolerans kuralları."""
+
+    def __init__(self, rules, default):
+        self.default = float(default)
+        self.rules = []
+        for order, rule in enumerate(rules):
+            sizes = rule.get('bedenler') or ''
+            m = SIZE_RANGE_PATTERN.match(sizes)
+            size_match = ('range', float(m.group(1).replace(',', '.')), float(m.group(2).replace(',', '.'))) if m else \
+                ('set', {s.strip().upper() for s in sizes.split(',') if s.strip()}) if sizes else None
+            specificity = 4 * (rule['business_unit'] != '*') + 2 * (size_match is not None) + (rule['olcu'] != '*')
+            self.rules.append((specificity, order, rule['business_unit'], rule['olcu'], size_match, float(rule['tolerans'])))
+        self.rules.sort(key=lambda r: (r[0], r[1]), reverse=True) # ilk eşleşen kazanır
+        self.key = hashlib.sha1(json.dumps([self.default, rules], sort_keys=True).encode()).hexdigest()
+
+    @staticmethod
+    def _size_matches(size_match, beden):
+        if size_match is None: return True
+        if size_match[0] == 'set': return beden.upper() in size_match[1]
+        try:
+            value = float(beden.replace(',', '.'))
+        except ValueError:
+            return False
+        return size_match[1] <= value <= size_match[2]
+
+    def limit(self, bu, beden, dim):
+        """Tek bir (BU, beden, ölçü) için sınır."""
+        for _, _, r_bu, r_dim, size_match, tol in self.rules:
+            if r_bu not in ('*', bu) or r_dim not in ('*', dim): continue
+            if self._size_matches(size_match, beden): return tol
+        return self.default
+
+    def limits(self, bu, beden):
+        """Satır dizileri için (n, 3) sınır matrisi; sütunlar TOLERANCE_DIMS sırasında."""
+        pairs = pd.MultiIndex.from_arrays([pd.Index(np.asarray(bu, dtype=object)), pd.Index(pd.Series(beden).astype(str).str.replace('*', '', regex=False).str.strip().to_numpy(dtype=object))])
+        codes, uniques = pairs.factorize()
+        table = np.array([[self.limit(b, s, d) for d in TOLERANCE_DIMS] for b, s in uniques], dtype=float).reshape(-1, len(TOLERANCE_DIMS))
+        return table[codes]
+
+    def faults(self, bu, beden, farklar):
+        """Fark matrisinde sınırı aşan hücreler (n, 3) bool."""
+        if len(farklar) == 0: return np.zeros((0, len(TOLERANCE_DIMS)), dtype=bool)
+        return np.abs(np.asarray(farklar, dtype=float)) > self.limits(bu, beden)
+
+@st.cache_resource(max_entries=8)
+def compile_tolerance_rules(rules_json, default):
+    return ToleranceRules(json.loads(rules_json), default)
+
+def get_tolerance_rules(config=None):
+    """Ayarlardaki kuralların derlenmiş hali (kurallar değişene kadar önbellekte)."""
+    config = config or get_system_config()
+    return compile_tolerance_rules(json.dumps(config.get('tolerance_rules', []), sort_keys=True), config.get('tolerance', 0.25))
+
+def evaluate_parts(parts, rules, business_unit):
+    """Bir yüklemenin tüm parçalarını tek geçişte değerlendirir; {unique_id: hata hücreleri} döner."""
+    parts = [p for p in parts if len(p['df'])]
+    if not parts: return {}
+    bedenler = pd.concat([p['df']['Beden'].astype(str) for p in parts], ignore_index=True)
+    farklar = pd.concat([fark_values(p['df']) for p in parts], ignore_index=True)[FARK_COLUMNS]
+    cells = rules.faults(np.full(len(bedenler), business_unit, dtype=object), bedenler, farklar)
+    bounds = np.cumsum([0] + [len(p['df']) for p in parts])
+    return {p['unique_id']: cells[bounds[i]:bounds[i + 1]] for i, p in enumerate(parts)}
+
+def summarize_record_faults(records, rules):
+    """Kayıtların hata detaylarını tek tabloda değerlendirir.
+
+    ({kayıt sırası: en büyük sapma}, {kayıt sırası: hata özeti metni}) döner.
+    """
+    rows = [(i, p.get('parca_adi'), rec.get('business_unit') or '-', str(det.get('Beden', '?')), det.get('Fark_Boy'), det.get('Fark_En'), det.get('Fark_Cevre'))
+            for i, rec in enumerate(records) for p in rec.get('parca_detaylari', []) if p.get('durum') == 'Hatalı'
+            for det in p.get('hata_detayi', [])]
+    if not rows: return {}, {}
+    details = pd.DataFrame(rows, columns=['kayit', 'parca_adi', 'business_unit', 'Beden'] + FARK_COLUMNS)
+    farklar = details[FARK_COLUMNS].apply(pd.to_numeric, errors='coerce').fillna(0.0)
+    cells = rules.faults(details['business_unit'].to_numpy(dtype=object), details['Beden'], farklar)
+    max_devs = farklar.abs().max(axis=1).groupby(details['kayit']).max().to_dict()
+
+    # Metin sadece sınırı aşan satırlar için üretilir
+    labels = ("Boy", "En", "Çv")
+    faulty = cells.any(axis=1)
+    texts = [f"{beden}[{','.join(f'{l}:{v:.2f}' for l, v, c in zip(labels, vals, row_cells) if c)}]"
+             for beden, vals, row_cells in zip(details['Beden'][faulty], farklar.to_numpy()[faulty], cells[faulty])]
+    per_part = pd.DataFrame({'kayit': details['kayit'][faulty], 'parca_adi': details['parca_adi'][faulty].astype(str), 'metin': texts})
+    per_part = per_part.groupby(['kayit', 'parca_adi'], sort=False)['metin'].agg(' '.join).reset_index()
+    per_part['metin'] = per_part['parca_adi'] + ": " + per_part['metin']
+    summaries = per_part.groupby('kayit', sort=False)['metin'].agg(" | ".join).to_dict()
+    return max_devs, summaries
+
+# --- KAYIT ÖZETLERİ (ROLLUP) ---
+# qc_rollups/{gün}_{BU}_{sezon}: günlük BU × sezon sayaçları ve model bazında
+# kırılımı. Her kayıtla aynı batch içinde Increment ile güncellenir; pano sadece
+# bu birkaç dokümanı okur, qc_records taranmaz.
+ROLLUP_COLLECTION = 'qc_rollups'
+ROLLUP_COUNTERS = ('kayit', 'hatali_kayit', 'parca', 'hatali_parca')
+
+def _rollup_doc_id(gun, bu, sezon):
+    return f"{gun}_{bu}_{sezon}".replace("/", "-")
+
+def _record_counts(doc_data):
+    hatali_parca = sum(1 for p in doc_data.get('parca_detaylari', []) if p.get('durum') == 'Hatalı')
+    return {
+        'kayit': 1,
+        'hatali_kayit': int(doc_data.get('genel_durum') == 'Hatalı'),
+        'parca': int(doc_data.get('parca_sayisi', 0)),
+        'hatali_parca': hatali_parca
+    }
+
+def add_rollup_writes(writer, doc_data):
+    """Kaydın özet sayaç artışlarını verilen batch/transaction'a ekler."""
+    gun = doc_data['tarih'].strftime('%Y-%m-%d')
+    bu = doc_data.get('business_unit') or '-'; sezon = doc_data.get('sezon') or '-'; model = doc_data.get('model_adi') or '-'
+    counts = _record_counts(doc_data)
+    writer.set(db.collection(ROLLUP_COLLECTION).document(_rollup_doc_id(gun, bu, sezon)), {
+        'gun': gun, 'business_unit': bu, 'sezon': sezon,
+        **{k: firestore.Increment(v) for k, v in counts.items()},
+        'modeller': {model: {k: firestore.Increment(v) for k, v in counts.items()}}
+    }, merge=True)
+    fs_op('write')
+
+@st.cache_data(ttl=60, show_spinner=False)
+def load_rollups(start_day, end_day):
+    """İki tarih (YYYY-MM-DD, dahil) arasındaki özet dokümanlarını çeker."""
+    if not db: return []
+    query = db.collection(ROLLUP_COLLECTION).where('gun', '>=', start_day).where('gun', '<=', end_day)
+    docs = [d.to_dict() for d in query.stream()]
+    fs_op('read', max(1, len(docs)))
+    return docs
+
+def rebuild_rollups():
+    """Tüm qc_records'u bir kez tarayıp özetleri yeniden yazar (özet öncesi kayıtlar için).
+
+    Tarama sırasında yapılan kayıtların artışları üzerine yazılabileceğinden yoğun saatlerde çalıştırılmamalıdır.
+    """
+    if not db: return 0
+    rollups = {}
+    for doc in db.collection('qc_records').select(['tarih', 'business_unit', 'sezon', 'model_adi', 'genel_durum', 'parca_sayisi', 'parca_detaylari']).stream():
+        d = doc.to_dict(); fs_op('read')
+        if not d.get('tarih'): continue
+        gun = pd.to_datetime(d['tarih']).strftime('%Y-%m-%d')
+        bu = d.get('business_unit') or '-'; sezon = d.get('sezon') or '-'; model = d.get('model_adi') or '-'
+        r = rollups.setdefault(_rollup_doc_id(gun, bu, sezon), {'gun': gun, 'business_unit': bu, 'sezon': sezon, 'modeller': {}, **dict.fromkeys(ROLLUP_COUNTERS, 0)})
+        m = r['modeller'].setdefault(model, dict.fromkeys(ROLLUP_COUNTERS, 0))
+        for k, v in _record_counts(d).items():
+            r[k] += v; m[k] += v
+    items = list(rollups.items())
+    for chunk in _chunked(items, 500):
+        batch = db.batch()
+        for doc_id, data in chunk:
+            batch.set(db.collection(ROLLUP_COLLECTION).document(doc_id), data)
+        batch.commit(); fs_op('write', len(chunk))
+    load_rollups.clear()
+    return len(items)
+
+# --- SAPMA DAĞILIMI ÖZETLERİ (SKETCH) ---
+# qc_sketches/{model-sezon-parça}: her beden ve ölçü (boy/en/çevre) için
+# |Fark| değerlerinin logaritmik kova sayaçları (DDSketch benzeri). Kovalar
+# sadece Increment ile güncellendiğinden özetler sırasız ve eşzamanlı yazımlarla
+# birleştirilebilir; yüzdelik hatası göreli olarak SKETCH_ALPHA ile sınırlıdır.
+SKETCH_COLLECTION = 'qc_sketches'
+SKETCH_ALPHA = 0.01
+SKETCH_GAMMA = (1 + SKETCH_ALPHA) / (1 - SKETCH_ALPHA)
+SKETCH_MIN = 0.001 # cm; bunun altı sıfır kovasına ('z') düşer
+SKETCH_DIMS = {'Fark_Boy': 'boy', 'Fark_En': 'en', 'Fark_Cevre': 'cevre'}
+
+def _sketch_doc_id(model, season, part):
+    return f"{model}-{season}-{part}".replace("/", "-")
+
+def sketch_updates(df):
+    """Fark tablosundan {beden: {ölçü: {n, pozitif, max, b: {kova: adet}}}} artışlarını üretir."""
+    updates = {}
+    for col, dim in SKETCH_DIMS.items():
+        if col not in df.columns: continue
+        frame = pd.DataFrame({'Beden': df['Beden'].astype(str).to_numpy(), 'v': pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=float)}).dropna()
+        frame = frame[frame['Beden'] != '']
+        if frame.empty: continue
+        a = frame['v'].abs().to_numpy()
+        keys = np.ceil(np.log(np.maximum(a, SKETCH_MIN)) / math.log(SKETCH_GAMMA)).astype(int).astype(str)
+        frame['k'] = np.where(a < SKETCH_MIN, 'z', keys)
+        frame['a'] = a; frame['pos'] = frame['v'] > 0
+        for beden, g in frame.groupby('Beden', sort=False):
+            updates.setdefault(beden, {})[dim] = {
+                'n': firestore.Increment(len(g)),
+                'pozitif': firestore.Increment(int(g['pos'].sum())),
+                'max': firestore.Maximum(float(g['a'].max())),
+                'b': {k: firestore.Increment(int(c)) for k, c in g['k'].value_counts().items()}
+            }
+    return updates
+
+def add_sketch_writes(writer, model, season, part, df):
+    """Parçanın fark dağılımını verilen batch/transaction'a ekler."""
+    updates = sketch_updates(df)
+    if not updates: return
+    writer.set(db.collection(SKETCH_COLLECTION).document(_sketch_doc_id(model, season, part)), {
+        'model_adi': model, 'sezon': season, 'parca_adi': part, 'bedenler': updates
+    }, merge=True)
+    fs_op('write')
+
+def _bucket_value(key):
+    return 0.0 if key == 'z' else 2 * SKETCH_GAMMA ** int(key) / (SKETCH_GAMMA + 1)
+
+def sketch_quantiles(sketch, qs=(0.5, 0.95)):
+    """Kova sayaçlarından yüzdelikleri tahmin eder; {'n', 'p50', 'p95', ..., 'max'} döner."""
+    buckets = sorted(((_bucket_value(k), c) for k, c in (sketch.get('b') or {}).items() if c), key=lambda x: x[0])
+    n = sum(c for _, c in buckets)
+    out = {'n': n}
+    for q in qs:
+        rank = q * (n - 1); seen = 0; value = None
+        for v, c in buckets:
+            seen += c
+            if seen > rank: value = v; break
+        out[f"p{int(q * 100)}"] = value
+    out['max'] = sketch.get('max')
+    return out
+
+@st.cache_data(ttl=60, show_spinner=False)
+def load_sketches(model):
+    """Bir modelin tüm parça özetlerini çeker (ham kayıtlar okunmaz)."""
+    if not db: return []
+    docs = [d.to_dict() for d in db.collection(SKETCH_COLLECTION).where('model_adi', '==', model).stream()]
+    fs_op('read', max(1, len(docs)))
+    return docs
+
+def sketch_table(docs, season=None):
+    """Özet dokümanlarını parça × beden × ölçü satırlarına açar."""
+    rows = []
+    for d in docs:
+        if season and d.get('sezon') != season: continue
+        for beden, dims in (d.get('bedenler') or {}).items():
+            for dim, sk in dims.items():
+                q = sketch_quantiles(sk)
+                rows.append({'parca_adi': d.get('parca_adi'), 'sezon': d.get('sezon'), 'Beden': beden, 'olcu': dim,
+                             'n': q['n'], 'p50': q['p50'], 'p95': q['p95'], 'max': q['max'],
+                             'pozitif_%': round(100 * sk.get('pozitif', 0) / q['n'], 1) if q['n'] else None})
+    return pd.DataFrame(rows)
+
+# --- KAYIT KUYRUĞU (OUTBOX) ---
+# Kayıtlar önce yerel bir SQLite (WAL) dosyasına yazılır ve hemen onaylanır;
+# arka plandaki tek iş parçacığı bunları Firestore'a aktarır. Doküman numarası
+# kuyruğa eklenirken belirlenir ve aktarım, doküman varsa hiçbir şey yazmayan
+# bir transaction'dır; yani tekrar denemeler kaydı veya sayaçları çiftlemez.
+# Aktarımda zaten var olduğu anlaşılan kayıtlar kullanıcıya bir sonraki
+# çalıştırmada bildirilir. Bir commit en fazla OUTBOX_MAX_WRITES yazma
+# içerebildiğinden, sığmayan parça özetleri kayıttan sonra ayrı batch'lerle
+# yazılır; kaçıncı parçaya kadar yazıldığı kuyrukta tutulur. OUTBOX_MAX_ATTEMPTS
+# denemede aktarılamayan kayıt 'failed' olur ve elle tekrar denenene kadar bekler.
+# Firestore erişilemezken kayıtlar dosyada bekler, uygulama yeniden başlasa da kaybolmaz.
+OUTBOX_PATH = os.environ.get("KALIP_OUTBOX_PATH", os.path.join(".kalip_cache", "outbox.sqlite3"))
+OUTBOX_POLL_SECONDS = 5
+OUTBOX_MAX_BACKOFF = 300 # sn
+OUTBOX_MAX_ATTEMPTS = 10
+OUTBOX_MAX_WRITES = 500 # Firestore'un commit başına yazma sınırı
+
+@firestore.transactional
+def _flush_record_txn(transaction, ref, doc_data, sketch_parts):
+    """Kaydı, özet sayaçlarını ve verilen parça özetlerini yazar (en fazla OUTBOX_MAX_WRITES - 2 parça)."""
+    snap = ref.get(transaction=transaction); fs_op('read')
+    if snap.exists: return False
+    transaction.set(ref, doc_data); fs_op('write')
+    add_rollup_writes(transaction, doc_data)
+    for model, season, part, df in sketch_parts:
+        add_sketch_writes(transaction, model, season, part, df)
+    return True
+
+def _flush_sketch_batch(sketch_parts):
+    batch = db.batch()
+    for model, season, part, df in sketch_parts:
+        add_sketch_writes(batch, model, season, part, df)
+    batch.commit()
+
+class Outbox:
+    """Kayıtları yerel dosyada tutup arka planda Firestore'a aktaran kuyruk."""
+
+    def __init__(self, path=OUTBOX_PATH, poll_seconds=OUTBOX_POLL_SECONDS):
+        self.path = path
+        self.poll_seconds = poll_seconds
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""CREATE TABLE IF NOT EXISTS outbox (
+                doc_id TEXT PRIMARY KEY, kullanici TEXT, model_adi TEXT, created REAL,
+                payload BLOB, attempts INTEGER DEFAULT 0, next_try REAL DEFAULT 0, last_error TEXT,
+                sketch_done INTEGER DEFAULT 0, status TEXT DEFAULT 'pending')""")
+            for column in ("sketch_done INTEGER DEFAULT 0", "status TEXT DEFAULT 'pending'"):
+                try: conn.execute(f"ALTER TABLE outbox ADD COLUMN {column}")
+                except sqlite3.OperationalError: pass # eski dosyada sütun zaten var
+        self._wake = threading.Event()
+        self._skipped = {} # kullanıcı -> aktarımda zaten var olduğu görülen model adları
+        self._skipped_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="outbox-flusher", daemon=True)
+        self._thread.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def enqueue(self, doc_data, sketch_parts=(), doc_id=None):
+        """Kaydı kuyruğa yazar; (doküman no, eklendi mi) döner.
+
+        sketch_parts: sapma özetine yazılacak (model, sezon, parça, fark tablosu) listesi.
+        Aynı doküman numarası zaten kuyruktaysa hiçbir şey yazılmaz.
+        """
+        doc_id = doc_id or uuid.uuid4().hex
+        payload = pickle.dumps((doc_data, list(sketch_parts)), protocol=pickle.HIGHEST_PROTOCOL)
+        with contextlib.closing(self._connect()) as conn, conn:
+            cur = conn.execute("INSERT OR IGNORE INTO outbox (doc_id, kullanici, model_adi, created, payload) VALUES (?, ?, ?, ?, ?)",
+                               (doc_id, doc_data.get('kullanici'), doc_data.get('model_adi'), time.time(), payload))
+        if cur.rowcount: self._wake.set()
+        return doc_id, bool(cur.rowcount)
+
+    def pending(self, user=None):
+        """Henüz aktarılmamış (bekleyen veya başarısız) kayıtlar (user verilirse sadece onunkiler)."""
+        query = "SELECT doc_id, kullanici, model_adi, created, attempts, last_error, status FROM outbox"
+        params = ()
+        if user is not None: query += " WHERE kullanici = ?"; params = (user,)
+        with contextlib.closing(self._connect()) as conn:
+            rows = conn.execute(query + " ORDER BY created", params).fetchall()
+        return [dict(zip(('doc_id', 'kullanici', 'model_adi', 'created', 'attempts', 'last_error', 'status'), r)) for r in rows]
+
+    def retry_failed(self, user=None):
+        """Başarısız kayıtları yeniden bekleyen duruma alır."""
+        query = "UPDATE outbox SET status = 'pending', attempts = 0, next_try = 0 WHERE status = 'failed'"
+        params = ()
+        if user is not None: query += " AND kullanici = ?"; params = (user,)
+        with contextlib.closing(self._connect()) as conn, conn:
+            conn.execute(query, params)
+        self._wake.set()
+
+    def take_skipped(self, user):
+        """Kullanıcının zaten var olduğu için aktarılmayan kayıtlarının model adlarını döner ve unutur."""
+        with self._skipped_lock:
+            return self._skipped.pop(user, [])
+
+    def flush_now(self):
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.poll_seconds); self._wake.clear()
+            try:
+                self._flush_due()
+            except Exception:
+                logging.getLogger("kalip.outbox").exception("outbox flush failed")
+
+    def _flush_due(self):
+        if not db: return
+        with contextlib.closing(self._connect()) as conn:
+            due = conn.execute("SELECT doc_id, payload, attempts, sketch_done FROM outbox WHERE status = 'pending' AND next_try <= ? ORDER BY created",
+                               (time.time(),)).fetchall()
+        flushed = 0
+        for doc_id, payload, attempts, sketch_done in due:
+            written = True
+            try:
+                doc_data, sketch_parts = pickle.loads(payload)
+                if not sketch_done:
+                    first = sketch_parts[:OUTBOX_MAX_WRITES - 2] # kayıt + özet sayacı
+                    written = _flush_record_txn(db.transaction(), db.collection('qc_records').document(doc_id), doc_data, first)
+                    sketch_done = len(first) if written else len(sketch_parts)
+                    self._set_progress(doc_id, sketch_done)
+                # Kalan parçalar ayrı batch'lerle; her commit'ten sonra ilerleme kaydedilir ki tekrar denemede çiftlenmesin
+                while sketch_done < len(sketch_parts):
+                    chunk = sketch_parts[sketch_done:sketch_done + OUTBOX_MAX_WRITES]
+                    _flush_sketch_batch(chunk)
+                    sketch_done += len(chunk)
+                    self._set_progress(doc_id, sketch_done)
+            except Exception as e:
+                delay = min(OUTBOX_MAX_BACKOFF, self.poll_seconds * 2 ** attempts)
+                status = 'failed' if attempts + 1 >= OUTBOX_MAX_ATTEMPTS else 'pending'
+                with contextlib.closing(self._connect()) as conn, conn:
+                    conn.execute("UPDATE outbox SET attempts = attempts + 1, next_try = ?, last_error = ?, status = ? WHERE doc_id = ?",
+                                 (time.time() + delay, str(e)[:500], status, doc_id))
+                continue
+            with contextlib.closing(self._connect()) as conn, conn:
+                conn.execute("DELETE FROM outbox WHERE doc_id = ?", (doc_id,))
+            if not written:
+                with self._skipped_lock:
+                    self._skipped.setdefault(doc_data.get('kullanici'), []).append(doc_data.get('model_adi'))
+                continue
+            flushed += 1
+        if flushed:
+            load_rollups.clear(); load_sketches.clear()
+
+    def _set_progress(self, doc_id, sketch_done):
+        with contextlib.closing(self._connect()) as conn, conn:
+            conn.execute("UPDATE outbox SET sketch_done = ? WHERE doc_id = ?", (sketch_done, doc_id))
+
+@st.cache_resource
+def get_outbox():
+    """Süreç genelinde tek kayıt kuyruğu; açılışta bekleyen kayıtları aktarmaya başlar."""
+    return Outbox()
+
+def record_doc_id(doc_data, sketch_parts):
+    """Model, sezon, BU ve parça fark tablolarından belirlenimci doküman numarası üretir.
+
+    Kullanıcı ve tarih dahil edilmez; aynı içerik tekrar gönderildiğinde aynı numara çıkar.
+    """
+    h = hashlib.sha1(repr((doc_data.get('model_adi'), doc_data.get('sezon'), doc_data.get('business_unit'))).encode())
+    for model, season, part, df in sorted(sketch_parts, key=lambda p: str(p[2])):
+        cols = [c for c in FARK_COLUMNS if c in df.columns]
+        frame = pd.concat([df['Beden'].astype(str), fark_values(df[cols])], axis=1).sort_values('Beden', kind='stable')
+        h.update(str(part).encode() + b"\x00")
+        h.update(frame.to_csv(index=False).encode())
+    return h.hexdigest()
+
+def save_record(doc_data, sketch_parts):
+    """Kaydı içerik numarasıyla kuyruğa ekler; (doküman no, 'queued' veya 'duplicate') döner.
+
+    Canlı görünümde veya kuyrukta olan içerik hemen 'duplicate' döner. Görünümün
+    dışında kalan eski bir kayıt Firestore'a sorulmaz; aktarım transaction'ı onu
+    atlar ve kullanıcı pending_records_panel üzerinden bilgilendirilir.
+    """
+    doc_id = record_doc_id(doc_data, sketch_parts)
+    view = get_recent_records()
+    if view is not None and view.contains(doc_id): return doc_id, 'duplicate'
+    with perf_stage("outbox_enqueue"):
+        _, inserted = get_outbox().enqueue(doc_data, sketch_parts, doc_id)
+    return doc_id, 'queued' if inserted else 'duplicate'
+
+def save_notice(t):
+    """Önceki çalıştırmada yapılan kaydın sonucunu gösterir."""
+    notice = st.session_state.pop('save_notice', None)
+    if not notice: return
+    saved, skipped = notice
+    if saved: st.success(f"{t['save_queued']} ({saved})")
+    if skipped: st.warning(f"{t['duplicate_skipped']}: {skipped}")
+
+def pending_records_panel(t):
+    """Kullanıcının henüz Firestore'a aktarılmamış ve aktarımda atlanmış kayıtlarını gösterir."""
+    outbox = get_outbox()
+    skipped = outbox.take_skipped(st.session_state['username'])
+    if skipped: st.sidebar.warning(f"{t['duplicate_skipped']}: {', '.join(map(str, skipped))}")
+    is_admin = st.session_state['role'] == 'admin'
+    rows = outbox.pending(None if is_admin else st.session_state['username'])
+    if not rows: return
+    with st.sidebar.expander(f"⏳ {t['outbox_pending']}: {len(rows)}"):
+        df = pd.DataFrame(rows)
+        df['created'] = pd.to_datetime(df['created'], unit='s')
+        failed = df['status'] == 'failed'
+        if failed.any(): st.error(f"{t['outbox_failed']}: {int(failed.sum())}")
+        df['status'] = df['status'].map(lambda s: t['outbox_failed'] if s == 'failed' else t['job_queued'])
+        st.dataframe(df[['model_adi', 'kullanici', 'status', 'created', 'attempts', 'last_error']], hide_index=True, use_container_width=True)
+        if st.button(t["outbox_retry_btn"]):
+            outbox.retry_failed(None if is_admin else st.session_state['username'])
+
+# --- SON KAYITLAR GÖRÜNÜMÜ ---
+# En yeni RECENT_VIEW_LIMIT kayıt, süreç genelinde tek bir on_snapshot
+# dinleyicisiyle bellekte tutulur. Geçmiş sayfası her çalıştırmada sorgu atmak
+# yerine bu görünümü süzer; yeni kayıtlar dinleyici üzerinden kendiliğinden gelir.
+# Dinleyici koparsa yeniden başlatılır; başlatma başarısız oldukça denemeler
+# arasındaki süre katlanarak artar ve bu sürede sayfa doğrudan sorguya döner.
+RECENT_VIEW_LIMIT = int(os.environ.get("KALIP_RECENT_LIMIT", 1000))
+RECENT_VIEW_WAIT = 5 # sn; ilk anlık görüntü için beklenen en uzun süre
+RECENT_VIEW_RETRY = (10, 300) # sn; yeniden başlatma bekleme süresi (ilk, en fazla)
+
+class RecentRecordsView:
+    """qc_records'un en yeni kayıtlarının canlı, süreç içi kopyası."""
+
+    def __init__(self, limit=RECENT_VIEW_LIMIT):
+        self.limit = limit
+        self._records = {}
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._start_lock = threading.Lock()
+        self._watch = None
+        self._started = 0.0
+        self._retry_at = 0.0
+        self._retry_delay = RECENT_VIEW_RETRY[0]
+        # Dinleyici ilk records() çağrısında başlatılır; başlatma hatası sayfayı
+        # düşürmez, geri çekilmeye girilir ve doğrudan sorgu kullanılır
+
+    def _start(self):
+        if self._watch is not None:
+            try: self._watch.unsubscribe()
+            except Exception: pass
+        # Yeni dinleyici ilk anlık görüntüde tüm kümeyi baştan gönderir; kopukken
+        # silinen kayıtlar için REMOVED gelmeyeceğinden eski kopya temizlenir
+        with self._lock:
+            self._records = {}
+        self._ready.clear()
+        self._started = time.time()
+        query = db.collection('qc_records').order_by('tarih', direction=firestore.Query.DESCENDING).limit(self.limit)
+        self._watch = query.on_snapshot(self._on_snapshot)
+
+    def _available(self):
+        """Görünüm kullanılabilir mi; dinleyici kopmuşsa (geri çekilme süresi dışında) yeniden başlatır."""
+        with self._start_lock:
+            active = self._watch is not None and self._watch.is_active
+            if self._ready.is_set() and active: return True
+            if time.time() < self._retry_at: return False
+            if not active or time.time() - self._started > RECENT_VIEW_WAIT:
+                try:
+                    self._start()
+                except Exception:
+                    logging.getLogger("kalip.recent").exception("recent records listener failed to start")
+                    self._back_off(); return False
+        if self._ready.wait(RECENT_VIEW_WAIT):
+            self._retry_delay = RECENT_VIEW_RETRY[0]
+            return True
+        with self._start_lock:
+            if time.time() >= self._retry_at: self._back_off()
+        return False
+
+    def _back_off(self):
+        self._retry_at = time.time() + self._retry_delay
+        self._retry_delay = min(self._retry_delay * 2, RECENT_VIEW_RETRY[1])
+
+    def _on_snapshot(self, docs, changes, read_time):
+        # İlk çağrıda tüm sonuç kümesi, sonrakilerde sadece farklar gelir
+        with self._lock:
+            for change in changes:
+                if change.type.name == 'REMOVED':
+                    self._records.pop(change.document.id, None)
+                else:
+                    d = change.document.to_dict(); d['id'] = change.document.id
+                    self._records[change.document.id] = d
+        self._ready.set()
+
+    @property
+    def full(self):
+        return len(self._records) >= self.limit
+
+    def contains(self, doc_id):
+        with self._lock:
+            return doc_id in self._records
+
+    def records(self, user=None, limit=100):
+        """En yeni kayıtları döner (user verilirse sadece onunkiler); görünüm hazır değilse None."""
+        if not self._available(): return None
+        with self._lock:
+            rows = [r for r in self._records.values() if user is None or r.get('kullanici') == user]
+        rows.sort(key=lambda r: (r.get('tarih') is not None, r.get('tarih')), reverse=True)
+        return rows[:limit]
+
+@st.cache_resource
+def get_recent_records():
+    return RecentRecordsView() if db else None
+
+HISTORY_FIELDS = ['kullanici', 'tarih', 'business_unit', 'model_adi', 'sezon', 'genel_durum', 'parca_sayisi', 'parca_detaylari']
+
+def _history_query(user, before, limit):
+    where = [('kullanici', '==', user)] if user else []
+    if before is not None: where.append(('tarih', '<', before))
+    return query_read('qc_records', where, 'tarih', limit=limit, fields=HISTORY_FIELDS)
+
+@st.cache_data(ttl=300, show_spinner=False)
+def query_user_records(user, before, limit):
+    """Görünümün dışında kalan eski kayıtlar için doğrudan sorgu (before: en eski görünen tarih)."""
+    return fetch(records=_history_query(user, before, limit))['records']
+
+def history_reads(user=None, limit=100):
+    """Geçmiş sayfası: (canlı görünümden gelen satırlar, Firestore'dan yapılması gereken okumalar).
+
+    Görünüm yoksa liste sorgusu okumalara eklenir; sayfa onu ayarlarla birlikte tek seferde çeker.
+    """
+    view = get_recent_records()
+    rows = view.records(user, limit) if view else None
+    if rows is None:
+        return [], {'records': _history_query(user, None, limit)}
+    # Kullanıcının daha eski kayıtları görünüm penceresinin dışında kalmış olabilir
+    if user and len(rows) < limit and view.full:
+        before = rows[-1]['tarih'] if rows else None
+        with perf_stage("firestore_history"):
+            rows = rows + query_user_records(user, before, limit - len(rows))
+    return rows, {}
+
+# --------------------------------------------------------------------------
+# 6. SAYFA DÜZENİ VE AKIŞ
 # --------------------------------------------------------------------------
 
 def main():
@@ -667,7 +2718,7 @@ def main():
     
     if 'current_model' not in st.session_state: st.session_state['current_model'] = {}
     if 'model_parts' not in st.session_state: st.session_state['model_parts'] = [] 
-    if 'excel_results' not in st.session_state: st.session_state['excel_results'] = {} 
+    if 'model_part_frames' not in st.session_state: st.session_state['model_part_frames'] = []
     if 'uploader_key' not in st.session_state: st.session_state['uploader_key'] = 0
     if 'show_reset_form' not in st.session_state: st.session_state['show_reset_form'] = False
 
@@ -726,6 +2777,7 @@ def main():
                         if email_input:
                             success, msg = reset_password_flow(email_input)
                             if success:
+                                st.session_state['reset_mail_job'] = msg
                                 st.success(t["reset_success"])
                             else:
                                 if msg == "USER_NOT_FOUND":
@@ -736,6 +2788,14 @@ def main():
                         else:
                             st.warning("Lütfen e-posta adresinizi giriniz.")
 
+                # Son sıfırlama mailinin durumu (gönderim arka planda sürer)
+                if st.session_state.get('reset_mail_job'):
+                    job = get_email_status(st.session_state['reset_mail_job'])
+                    if job:
+                        st.caption(f"{t['mail_status']}: {t.get('mail_' + job['status'], job['status'])}")
+                        if job['status'] == 'failed' and job.get('error'):
+                            st.error(f"{t['reset_error_mail']} \nDetay: {job['error']}")
+
         return
 
     # --- ANA UYGULAMA (GİRİŞ YAPILDIKTAN SONRA) ---
@@ -743,6 +2803,9 @@ def main():
     st.sidebar.write(f"👤 **{st.session_state['username']}** ({st.session_state['role']})")
     
     if st.sidebar.button(t["logout"]):
+        clear_session_result('excel_results'); clear_session_result('excel_prev')
+        st.session_state.pop('bulk_credentials', None)
+        get_job_manager().cancel_user(st.session_state['username']); st.session_state.pop('excel_job', None)
         st.session_state['logged_in'] = False
         st.session_state['username'] = ""
         st.session_state['role'] = ""
@@ -773,12 +2836,20 @@ def main():
     # Menü Seçenekleri
     menu_keys = ["menu_manual", "menu_excel", "menu_history"]
     if st.session_state['role'] == 'admin':
-        menu_keys.append("menu_admin")
+        # Pano tüm kullanıcıların kayıtlarından derlenen özetleri gösterir
+        menu_keys += ["menu_dashboard", "menu_admin"]
     
     menu_labels = [t[k] for k in menu_keys]
     st.sidebar.header(t["menu_header"])
     selected_label = st.sidebar.radio("Navigation", menu_labels, label_visibility="collapsed")
     selected_key = menu_keys[menu_labels.index(selected_label)]
+    perf_tag(selected_key)
+    if selected_key != "menu_admin":
+        st.session_state.pop('bulk_credentials', None) # yönetim sayfasından çıkınca şifreler bırakılır
+
+    pending_records_panel(t)
+    if st.session_state['role'] == 'admin':
+        diagnostics_panel(t)
 
     if selected_key == "menu_manual":
         new_control_page(t)
@@ -786,9 +2857,27 @@ def main():
         excel_control_page(t)
     elif selected_key == "menu_history":
         history_page(t)
+    elif selected_key == "menu_dashboard":
+        dashboard_page(t)
     elif selected_key == "menu_admin":
         admin_users_page(t)
 
+def diagnostics_panel(t):
+    """Admin'e özel performans tanılama paneli (kenar çubuğu)."""
+    with st.sidebar.expander(t["diag_title"]):
+        st.toggle(t["diag_enable"], key="perf_enabled", disabled=os.environ.get("KALIP_PERF") == "1")
+        last = st.session_state.get('perf_last')
+        if not last:
+            st.caption(t["diag_empty"]); return
+        totals = st.session_state.get('perf_session', {})
+        st.caption(f"{t['diag_last_run']}: {last['page']} | {last['total_ms']} ms | {t['diag_rss_peak'] if last.get('rss_peak') else 'RSS'} {last['rss_kb'] // 1024} MB")
+        c1, c2 = st.columns(2)
+        c1.metric(t["diag_reads"], last['fs_read'], help=f"{t['diag_session']}: {totals.get('fs_read', 0)}")
+        c2.metric(t["diag_writes"], last['fs_write'], help=f"{t['diag_session']}: {totals.get('fs_write', 0)}")
+        if last['stages']:
+            st.dataframe(pd.DataFrame(last['stages']), use_container_width=True, hide_index=True)
+        st.caption(f"{t['diag_session']}: {totals.get('runs', 0)} run | {round(totals.get('ms', 0))} ms | {PERF_LOG_PATH}")
+
 def admin_users_page(t):
     st.header(t["admin_title"])
     
@@ -810,6 +2899,24 @@ def admin_users_page(t):
                     st.rerun()
                 else:
                     st.error("Hata oluştu.")
+
+        # BU / ölçü / beden bazında tolerans kuralları
+        st.markdown(f"**{t['tolerance_rules_title']}**")
+        st.caption(t["tolerance_rules_help"])
+        rules_df = pd.DataFrame(current_config.get('tolerance_rules', []), columns=['business_unit', 'olcu', 'bedenler', 'tolerans'])
+        edited = st.data_editor(rules_df, num_rows="dynamic", use_container_width=True, key="tolerance_rules_editor", column_config={
+            'business_unit': st.column_config.SelectboxColumn("BU", options=['*'] + BUSINESS_UNITS, default='*', required=True),
+            'olcu': st.column_config.SelectboxColumn(t["rule_dim"], options=['*'] + list(TOLERANCE_DIMS), default='*', required=True),
+            'bedenler': st.column_config.TextColumn(t["rule_sizes"], help=t["rule_sizes_help"]),
+            'tolerans': st.column_config.NumberColumn(t["tolerance_label"], min_value=0.0, step=0.01, format="%.2f", required=True)
+        })
+        if st.button(t["save_rules_btn"]):
+            clean, errors = validate_tolerance_rules(edited.dropna(how='all').to_dict('records'))
+            if errors: st.error(f"{t['rules_invalid']}: {', '.join(errors)}")
+            elif update_tolerance_rules(clean):
+                st.success(t["settings_saved"]); st.rerun()
+            else:
+                st.error("Hata oluştu.")
     
     st.divider()
     
@@ -823,27 +2930,55 @@ def admin_users_page(t):
             submitted = st.form_submit_button(t["create_user_btn"])
             
             if submitted:
-                if create_user(new_user, new_pass, new_role, new_email):
+                ok, code = create_user(new_user, new_pass, new_role, new_email)
+                if ok:
                     st.success(t["user_created"])
+                elif code == "EMAIL_TAKEN":
+                    st.error(t["email_taken_err"])
                 else:
                     st.error(t["user_create_err"])
 
+    with st.expander(t["bulk_title"]):
+        bulk_users_section(t)
+
     st.divider()
     
     if db:
-        users = db.collection('users').stream()
-        user_list = []
-        for u in users:
-            user_list.append(u.to_dict())
+        # Kullanıcı dizini önbellekten gelir; sadece seçili sayfa çizilir
+        f1, f2, f3 = st.columns([2, 1, 1])
+        name_filter = f1.text_input(t["user_filter"], key="user_filter")
+        role_opts = {t["status_all"]: None, "user": "user", "admin": "admin"}
+        role_filter = role_opts[f2.selectbox(t["role_select"], list(role_opts.keys()), key="user_role_filter")]
+        df_filtered = filter_user_directory(name_filter, role_filter)
+        page_count = max(1, -(-len(df_filtered) // USER_PAGE_SIZE))
+        st.session_state.setdefault('user_page', 1)
+        if st.session_state['user_page'] > page_count: st.session_state['user_page'] = page_count
+        page = f3.number_input(t["page"], min_value=1, max_value=page_count, key="user_page")
+        df_users = df_filtered.iloc[(page - 1) * USER_PAGE_SIZE: page * USER_PAGE_SIZE]
+        st.caption(f"{len(df_filtered)} {t['user']} | {t['page']} {page}/{page_count}")
+
+        dups = duplicate_emails()
+        if not dups.empty:
+            st.warning(f"{t['dup_email_title']}: {len(dups)}")
+            st.caption(t["dup_email_help"])
+            st.dataframe(dups, use_container_width=True, hide_index=True)
         
-        if user_list:
-            df_users = pd.DataFrame(user_list)
-            # Email sütununu da göster
-            if 'email' in df_users.columns:
-                st.dataframe(df_users[['username', 'role', 'email']], use_container_width=True)
-            else:
-                st.dataframe(df_users[['username', 'role']], use_container_width=True)
+        if not df_users.empty:
+            st.dataframe(df_users, use_container_width=True, hide_index=True)
             
+            with st.expander(t["change_email_title"]):
+                with st.form("change_email_form"):
+                    email_user = st.selectbox(t["username"], df_users['username'].unique())
+                    email_new = st.text_input(t["email"])
+                    if st.form_submit_button(t["update_email_btn"]):
+                        ok, code = update_user_email(email_user, email_new)
+                        if ok:
+                            st.success(t["email_updated"])
+                        elif code == "EMAIL_TAKEN":
+                            st.error(t["email_taken_err"])
+                        else:
+                            st.error(t["user_create_err"])
+
             user_to_delete = st.selectbox(t["delete_user_btn"], df_users['username'].unique())
             if st.button("Sil / Delete"):
                 if user_to_delete == 'admin' or user_to_delete == st.session_state['username']:
@@ -853,63 +2988,130 @@ def admin_users_page(t):
                     st.success(f"{user_to_delete} deleted!")
                     st.rerun()
 
+def bulk_users_section(t):
+    """Toplu kullanıcı içe aktarma, yetki değiştirme ve silme."""
+    tab_import, tab_role, tab_delete = st.tabs([t["bulk_import_tab"], t["bulk_role_tab"], t["bulk_delete_tab"]])
+    protected = {'admin', st.session_state['username']}
+
+    with tab_import:
+        st.caption(t["bulk_columns_info"])
+        # İçe aktarma sonrası anahtar değişir; yüklenen dosya temizlenir ve
+        # yeni oluşan kullanıcılar yeniden doğrulanıp USER_EXISTS olarak listelenmez
+        upload_key = st.session_state.setdefault('bulk_uploader_key', 0)
+        up = st.file_uploader(t["bulk_upload_label"], type=["csv", "xlsx"], key=f"bulk_user_file_{upload_key}")
+        if up:
+            st.session_state.pop('bulk_import_result', None)
+            try:
+                rows, errors = validate_user_import(read_user_import_file(up))
+            except Exception as e:
+                st.error(f"{t['error_parse']}: {e}"); rows, errors = [], []
+            st.caption(f"✅ {len(rows)} | ⚠️ {len(errors)}")
+            if errors:
+                st.error(t["bulk_fix_errors"])
+                st.dataframe(pd.DataFrame(errors), use_container_width=True, hide_index=True)
+            elif rows:
+                send_mail = st.checkbox(t["bulk_send_mail"], value=True)
+                if st.button(t["bulk_import_btn"], type="primary"):
+                    created, failed = bulk_create_users(rows, send_mail)
+                    st.session_state['bulk_credentials'] = pd.DataFrame(created, columns=['username', 'email', 'password']).to_csv(index=False)
+                    st.session_state['bulk_import_result'] = ([{k: r.get(k) for k in ('username', 'email', 'mail')} for r in created], failed)
+                    st.session_state['bulk_uploader_key'] = upload_key + 1
+                    st.rerun()
+        if st.session_state.get('bulk_import_result'):
+            created, failed = st.session_state['bulk_import_result']
+            st.success(f"{t['bulk_import_done']}: {len(created)}")
+            if failed: st.warning(f"{t['user_create_err']} {', '.join(failed)}")
+            mail_failed = [r for r in created if r['mail'] not in (None, "SUCCESS")]
+            if mail_failed: st.error(f"{t['bulk_mail_failed']}: {len(mail_failed)}")
+            if created:
+                result_df = pd.DataFrame(created)
+                result_df['mail'] = result_df['mail'].map(lambda m: "-" if m is None else t['mail_queued'] if m == "SUCCESS" else f"{t['mail_failed']}: {m}")
+                st.dataframe(result_df, use_container_width=True, hide_index=True)
+        if st.session_state.get('bulk_credentials'):
+            # Şifreler indirildikten sonra oturumda tutulmaz
+            st.download_button(t["bulk_credentials_dl"], st.session_state['bulk_credentials'], file_name="kullanicilar.csv", mime="text/csv",
+                               on_click=lambda: st.session_state.pop('bulk_credentials', None))
+
+    all_users = [u for u in filter_user_directory()['username'] if u not in protected]
+
+    with tab_role:
+        with st.form("bulk_role_form"):
+            selected = st.multiselect(t["bulk_select_users"], all_users)
+            role = st.selectbox(t["role_select"], VALID_ROLES)
+            if st.form_submit_button(t["bulk_apply_role_btn"]) and selected:
+                if bulk_update_roles(selected, role): st.success(f"{t['bulk_done']}: {len(selected)}")
+                else: st.error(t["user_create_err"])
+
+    with tab_delete:
+        with st.form("bulk_delete_form"):
+            selected = st.multiselect(t["bulk_select_users"], all_users)
+            confirm = st.checkbox(t["bulk_confirm"])
+            if st.form_submit_button(t["bulk_delete_btn"]) and selected:
+                if not confirm: st.warning(t["bulk_confirm"])
+                elif bulk_delete_users(selected): st.success(f"{t['bulk_done']}: {len(selected)}")
+                else: st.error(t["user_create_err"])
+
 def excel_control_page(t):
     st.header(t["excel_title"])
     st.info(t["excel_info"])
+    save_notice(t)
 
     # --- SİSTEM TOLERANSINI ÇEK ---
     system_config = get_system_config()
     tolerans = system_config.get('tolerance', 0.25)
-    st.markdown(f"**ℹ️ Aktif Hata Toleransı / Active Tolerance:** `{tolerans} cm`")
+    rules = get_tolerance_rules(system_config)
+    st.markdown(f"**ℹ️ Aktif Hata Toleransı / Active Tolerance:** `{tolerans} cm`" + (f" + {len(rules.rules)} {t['tolerance_rules_count']}" if rules.rules else ""))
 
     col1, col2 = st.columns(2)
     with col1:
-        business_unit = st.selectbox(t["bu_select"], ["BU1", "BU3", "BU5"], key="excel_bu")
+        business_unit = st.selectbox(t["bu_select"], BUSINESS_UNITS, key="excel_bu")
     
-    uploaded_file = st.file_uploader(t["upload_label"], type=["xlsx"], key=f"uploader_{st.session_state['uploader_key']}")
+    uploaded_file = st.file_uploader(t["upload_label"], type=sorted(INPUT_READERS), key=f"uploader_{st.session_state['uploader_key']}", help=t["upload_formats_help"])
 
     if uploaded_file:
         if st.button(t["analyze_file_btn"], type="primary"):
-            with st.spinner("..."):
-                try:
-                    xls = pd.read_excel(uploaded_file, sheet_name=None, header=None)
-                    sheet_names = list(xls.keys())
-                    all_gerber_parts = {}
-                    all_pp_parts = {}
-                    for sheet in sheet_names:
-                        sheet_upper = sheet.upper()
-                        df_sheet = xls[sheet]
-                        if "GERBER" in sheet_upper:
-                            all_gerber_parts.update(parse_excel_gerber_sheet(df_sheet))
-                        elif "PP" in sheet_upper or "POLY" in sheet_upper:
-                            all_pp_parts.update(parse_excel_pp_sheet(df_sheet))
-                    
-                    if not all_gerber_parts: st.error("Gerber?"); return
-                    if not all_pp_parts: st.error("Polypattern?"); return
-                    
-                    grouped_results = {}
-                    for unique_id, pp_data in all_pp_parts.items():
-                        if unique_id in all_gerber_parts:
-                            gerber_data = all_gerber_parts[unique_id]
-                            df_g = gerber_data['df']; df_p = pp_data['df']; meta = pp_data['meta']
-                            try:
-                                df_final = df_g.merge(df_p, on="Beden", how="inner")
-                                df_final['Fark_Boy'] = df_final['boy'] - df_final['poly_boy']
-                                df_final['Fark_En'] = df_final['en'] - df_final['poly_en']
-                                df_final['Fark_Cevre'] = df_final['cevre'] - df_final['poly_cevre']
-                                model_key = f"{meta['model']} ({meta['season']})"
-                                if model_key not in grouped_results:
-                                    grouped_results[model_key] = {"model": meta['model'], "season": meta['season'], "parts": []}
-                                grouped_results[model_key]["parts"].append({"parca_adi": meta['part'], "df": df_final})
-                            except: pass
-                    
-                    st.session_state['excel_results'] = grouped_results
-                    st.success("OK")
-                except Exception as e: st.error(f"{t['error_parse']}: {e}")
+            # Önceki yüklemenin durumu: değişmeyen sayfa/parçalar yeniden hesaplanmaz
+            prev = get_session_result('excel_prev')
+            data = uploaded_file.getvalue()
+            file_fp = hashlib.sha1(data).hexdigest()
+            if prev and prev.get('file_fp') == file_fp:
+                changes = {'added': [], 'changed': [], 'unchanged': list(prev['parts']), 'removed': []}
+                set_session_result('excel_results', group_results(prev['parts'], changes))
+                st.session_state['excel_changes'] = changes
+                st.success("OK")
+            else:
+                # Analiz arka plan havuzunda çalışır; sayfa iş durumunu yoklar
+                jobs = get_job_manager(); user = st.session_state['username']
+                if st.session_state.get('excel_job'): jobs.cancel(st.session_state['excel_job'], user)
+                job_id = jobs.submit(user, uploaded_file.name, file_analysis_job, data, uploaded_file.name, prev, file_fp)
+                if job_id is None: st.warning(t["job_limit"])
+                else: st.session_state['excel_job'] = job_id
 
-    if st.session_state.get('excel_results'):
-        results = st.session_state['excel_results']
+    if st.session_state.get('excel_job'):
+        excel_job_status(t)
+
+    results = get_session_result('excel_results')
+    if results:
         st.divider(); st.subheader(t["result"])
+        # Önceki yüklemeye göre değişiklikler
+        changes = st.session_state.get('excel_changes')
+        only_changed = False
+        if changes:
+            st.info(f"{t['changes_since_last']}: 🆕 {len(changes['added'])} | ✏️ {len(changes['changed'])} | 🗑️ {len(changes['removed'])} | = {len(changes['unchanged'])}")
+            if changes['removed']: st.caption(f"🗑️ {', '.join(changes['removed'])}")
+            if changes['unchanged']:
+                only_changed = st.toggle(t["show_only_changed"], value=bool(changes['added'] or changes['changed']))
+        change_icons = {'added': '🆕 ', 'changed': '✏️ ', 'unchanged': '', None: ''}
+        # TOLERANS KONTROLÜ: tüm parçalar tek geçişte; sonuç kurallar/BU/dosya değişene kadar saklanır
+        prev = get_session_result('excel_prev') or {}
+        eval_key = (prev.get('file_fp'), rules.key, business_unit)
+        cached = st.session_state.get('excel_eval')
+        if prev.get('file_fp') and cached and cached[0] == eval_key:
+            faults = cached[1]
+        else:
+            with perf_stage("tolerance_eval"):
+                faults = evaluate_parts([p for m in results.values() for p in m['parts']], rules, business_unit)
+            st.session_state['excel_eval'] = (eval_key, faults)
         for model_key, model_data in results.items():
             with st.container():
                 st.info(f"📌 {t['model']}: {model_key} | {t['slot_count']}: {len(model_data['parts'])}")
@@ -918,27 +3120,29 @@ def excel_control_page(t):
                 for part in model_data['parts']:
                     df = part['df']; parca_adi = part['parca_adi']
                     
-                    # TOLERANS KONTROLÜ (DB'den gelen değer kullanılıyor)
-                    hatali_satirlar = df[(df['Fark_Boy'].abs()>tolerans)|(df['Fark_En'].abs()>tolerans)|(df['Fark_Cevre'].abs()>tolerans)]
+                    cells = faults.get(part['unique_id'], np.zeros((len(df), len(FARK_COLUMNS)), dtype=bool))
+                    hatali_satirlar = pd.concat([df[['Beden']], fark_values(df)], axis=1)[cells.any(axis=1)]
                     hata_var = not hatali_satirlar.empty
                     if hata_var: has_fault = True
                     
-                    with st.expander(f"{'⚠️' if hata_var else '✅'} {parca_adi}", expanded=hata_var):
-                        cols = ['boy','poly_boy','en','poly_en','cevre','poly_cevre','Fark_Boy','Fark_En','Fark_Cevre']
-                        ex_cols = [c for c in cols if c in df.columns]
-                        st.dataframe(df.style.format("{:.2f}", subset=ex_cols).map(lambda x: 'background-color:#ffcccc' if isinstance(x,(int,float)) and abs(x)>tolerans else '', subset=['Fark_Boy','Fark_En','Fark_Cevre']), use_container_width=True)
-                    parts_list_for_save.append({"parca_adi": parca_adi, "durum": "Hatalı" if hata_var else "Doğru", "hata_detayi": hatali_satirlar[['Beden','Fark_Boy','Fark_En','Fark_Cevre']].to_dict('records') if hata_var else [], "timestamp": datetime.now()})
+                    # Sadece değişenler gösteriliyorsa aynı kalan parçalar çizilmez (kayıt için yine hesaplanır)
+                    change = part.get('change') if changes else None
+                    if not (only_changed and change == 'unchanged'):
+                        with st.expander(f"{'⚠️' if hata_var else '✅'} {change_icons[change]}{parca_adi}", expanded=hata_var and change != 'unchanged'):
+                            cols = ['boy','poly_boy','en','poly_en','cevre','poly_cevre','Fark_Boy','Fark_En','Fark_Cevre']
+                            ex_cols = [c for c in cols if c in df.columns]
+                            with perf_stage("render_styler"):
+                                st.dataframe(df.style.format("{:.2f}", subset=ex_cols).apply(lambda _: np.where(cells, 'background-color:#ffcccc', ''), axis=None, subset=FARK_COLUMNS), use_container_width=True)
+                    parts_list_for_save.append({"parca_adi": parca_adi, "durum": "Hatalı" if hata_var else "Doğru", "hata_detayi": hatali_satirlar.astype({'Beden': str}).to_dict('records') if hata_var else [], "timestamp": datetime.now()})
                 model_data['save_ready'] = {"genel_durum": "Hatalı" if has_fault else "Doğru Çevrilmiş", "parts_list": parts_list_for_save}
                 st.markdown("---")
 
         c_save, c_reset = st.columns([3, 1])
         with c_save:
             if st.button(t["save_all_btn"], type="primary", use_container_width=True):
-                if not db: return
-                batch = db.batch(); cnt = 0
+                saved = skipped = 0
                 for mk, data in results.items():
                     sinfo = data['save_ready']
-                    doc_ref = db.collection('qc_records').document()
                     doc_data = {
                         'kullanici': st.session_state['username'],
                         'tarih': datetime.now(),
@@ -949,17 +3153,66 @@ def excel_control_page(t):
                         'genel_durum': sinfo['genel_durum'],
                         'parca_detaylari': sinfo['parts_list']
                     }
-                    batch.set(doc_ref, doc_data); cnt += 1
-                batch.commit(); st.balloons(); st.success(t["save_success"]); st.session_state['excel_results']={}; st.session_state['uploader_key']+=1; st.rerun()
+                    # Model kaydı, özet sayaçları ve parça dağılımları tek kuyruk kaydı olarak aktarılır
+                    _, result = save_record(doc_data, [(data['model'], data['season'], part['parca_adi'], part['df']) for part in data['parts']])
+                    if result == 'queued': saved += 1
+                    else: skipped += 1
+                st.session_state['save_notice'] = (saved, skipped)
+                if saved: st.balloons()
+                clear_session_result('excel_results'); st.session_state['uploader_key']+=1; st.rerun()
         with c_reset:
-            if st.button(t["reset_btn"], use_container_width=True): st.session_state['excel_results']={}; st.session_state['uploader_key']+=1; st.rerun()
+            if st.button(t["reset_btn"], use_container_width=True): clear_session_result('excel_results'); st.session_state['uploader_key']+=1; st.rerun()
+
+def excel_job_status(t):
+    """Excel analiz işinin ilerlemesini gösterir; bitince sonuçları oturuma alır."""
+    jobs = get_job_manager(); user = st.session_state['username']
+    job_id = st.session_state['excel_job']
+    job = jobs.get(job_id, user)
+    if job is None:
+        del st.session_state['excel_job']; return
+
+    if job.active:
+        @st.fragment(run_every=JOB_POLL_SECONDS)
+        def job_progress():
+            current = jobs.get(job_id, user)
+            if current is None or not current.active: st.rerun()
+            st.progress(current.progress, text=f"{t['job_' + current.status]}: {current.label} {current.message}")
+            if current.partial:
+                st.caption(f"{', '.join(current.partial.get('sheets', []))} | {t['slot_count']}: {current.partial.get('parts', 0)}")
+            if st.button(t["job_cancel_btn"], key="cancel_excel_job"):
+                jobs.cancel(job_id, user); st.rerun()
+        job_progress()
+        return
+
+    del st.session_state['excel_job']
+    jobs.forget(job_id)
+    perf_merge(job.perf, "job:")
+    if job.status == 'done':
+        grouped_results, state, changes = job.result
+        set_session_result('excel_prev', state)
+        set_session_result('excel_results', grouped_results)
+        st.session_state['excel_changes'] = changes
+        st.success("OK")
+    elif job.status == 'failed':
+        st.error(f"{t['error_parse']}: {job.error}")
+    else:
+        st.info(t["job_cancelled"])
+
+MANUAL_SLOT_KEY = re.compile(r"(g_c|g_e|g_b|p)\d+")
 
 def new_control_page(t):
     st.header(t["menu_manual"])
+    save_notice(t)
+    # Model kaydedildiyse parça metinleri widget'lar çizilmeden temizlenir;
+    # aksi halde canlı mod aynı parçaları yeniden analiz edip listeye sunar
+    if st.session_state.pop('manual_reset', False):
+        for key in [k for k in st.session_state if isinstance(k, str) and MANUAL_SLOT_KEY.fullmatch(k)]:
+            del st.session_state[key]
     with st.expander(t["detail"], expanded=True):
         c1, c2 = st.columns(2)
-        with c1: business_unit = st.selectbox(t["bu_select"], ["BU1", "BU3", "BU5"])
-        with c2: slot_count = st.number_input(t["slot_count"], 1, 5, 1)
+        with c1: business_unit = st.selectbox(t["bu_select"], BUSINESS_UNITS)
+        with c2: slot_count = st.number_input(t["slot_count"], 1, MANUAL_MAX_SLOTS, 1)
+        live = st.toggle(t["live_mode"], key="manual_live", help=t["live_mode_help"])
     
     st.divider(); tabs = st.tabs([f"{t['part']} {i+1}" for i in range(slot_count)]); inputs = {}
     for i, tab in enumerate(tabs):
@@ -970,30 +3223,26 @@ def new_control_page(t):
                 with c2: st.subheader(t["pp_header"]); inputs[f"poly_{i}"]=st.text_area("Data",key=f"p{i}",height=340)
 
     st.markdown("---")
-    if st.button(t["analyze_btn"], type="primary", use_container_width=True):
+    if live:
+        # Canlı mod: her çalıştırmada sadece metni değişen parçalar ayrıştırılır
+        update_manual_results(inputs, slot_count, business_unit, t)
+    elif st.button(t["analyze_btn"], type="primary", use_container_width=True):
         st.session_state['analysis_results'] = {}
-        for i in range(slot_count):
-            gc=inputs[f"g_c_{i}"]; ge=inputs[f"g_e_{i}"]; gb=inputs[f"g_b_{i}"]; pp=inputs[f"poly_{i}"]
-            if not (gc and ge and gb and pp): continue
-            if 'active_session' not in st.session_state:
-                meta = parse_gerber_metadata(gc)
-                if meta: st.session_state['active_session']=True; st.session_state['current_model']={"model_adi":meta['model_adi'],"sezon":meta['sezon'],"bu":business_unit}
-            lmeta = parse_gerber_metadata(gc); pname = lmeta['parca_adi'] if lmeta else f"{t['part']} {i+1}"
-            dfc = parse_gerber_table(gc,'cevre'); dfe = parse_gerber_table(ge,'en'); dfb = parse_gerber_table(gb,'boy'); dfp = parse_polypattern(pp)
-            if not dfc.empty and not dfe.empty and not dfb.empty and not dfp.empty:
-                try:
-                    dft = dfc.merge(dfe, on="Beden").merge(dfb, on="Beden"); dff = dft.merge(dfp, on="Beden")
-                    dff['Fark_Boy']=dff['boy']-dff['poly_boy']; dff['Fark_En']=dff['en']-dff['poly_en']; dff['Fark_Cevre']=dff['cevre']-dff['poly_cevre']
-                    st.session_state['analysis_results'][i]={"df":dff, "parca_adi":pname, "saved":False}
-                except: st.error(f"{t['part']} {i+1} Err")
+        update_manual_results(inputs, slot_count, business_unit, t)
 
     if st.session_state.get('analysis_results'):
-        for i, res in st.session_state['analysis_results'].items():
-            if res['saved']: continue
-            with st.expander(f"{t['result']}: {res['parca_adi']}", expanded=True):
+        pending = {i: res for i, res in sorted(st.session_state['analysis_results'].items()) if not res['saved']}
+        for i, res in pending.items():
+            with st.expander(f"{t['result']}: {res['parca_adi']}", expanded=len(pending) <= 5):
                 st.dataframe(res['df'])
                 if st.button(f"{t['save_list_btn']} {i}", key=f"b_{i}"):
-                    st.session_state['model_parts'].append({"parca_adi":res['parca_adi'], "durum":"Doğru", "timestamp":datetime.now()}) 
+                    # Aynı parça (metni düzenlenmiş olsa da) modele ikinci kez eklenmez
+                    if any(p['parca_adi'] == res['parca_adi'] for p in st.session_state['model_parts']):
+                        st.session_state['save_notice'] = (0, res['parca_adi'])
+                    else:
+                        st.session_state['model_parts'].append({"parca_adi":res['parca_adi'], "durum":"Doğru", "timestamp":datetime.now()}) 
+                        st.session_state['model_part_frames'].append((res['parca_adi'], res['df']))
+                    st.session_state.setdefault('manual_saved_hashes', set()).add(res['hash'])
                     st.session_state['analysis_results'][i]['saved']=True; st.rerun()
 
     if st.session_state.get('active_session') and st.session_state['model_parts']:
@@ -1001,15 +3250,17 @@ def new_control_page(t):
             save_to_firestore(st.session_state['username'], business_unit, t)
 
 def save_to_firestore(user, bu, t):
-    if not db: return
     mdata = st.session_state['current_model']; parts = st.session_state['model_parts']
     genel = "Doğru Çevrilmiş"
-    db.collection('qc_records').add({
+    doc_data = {
         'kullanici': user, 'tarih': datetime.now(), 'business_unit': bu,
         'model_adi': mdata.get('model_adi'), 'sezon': mdata.get('sezon'),
         'parca_sayisi': len(parts), 'genel_durum': genel, 'parca_detaylari': parts
-    })
-    st.success(t["save_success"]); st.session_state['model_parts']=[]; st.session_state['current_model']={}; st.session_state['analysis_results']={}; del st.session_state['active_session']; st.rerun()
+    }
+    _, result = save_record(doc_data, [(mdata.get('model_adi'), mdata.get('sezon'), parca_adi, df) for parca_adi, df in st.session_state['model_part_frames']])
+    st.session_state['save_notice'] = (1, 0) if result == 'queued' else (0, 1)
+    st.session_state['model_parts']=[]; st.session_state['model_part_frames']=[]; st.session_state['current_model']={}; st.session_state['analysis_results']={}; del st.session_state['active_session']
+    st.session_state['manual_saved_hashes'] = set(); st.session_state['manual_reset'] = True; st.rerun()
 
 def history_page(t):
     st.header(t["history_title"])
@@ -1019,41 +3270,31 @@ def history_page(t):
     term = c1.text_input(t["search_placeholder"])
     status = c2.selectbox(t["filter_status"], [t["status_all"], t["status_faulty"], t["status_correct"]])
     
-    query = db.collection('qc_records')
-    if st.session_state['role'] != 'admin':
-        query = query.where('kullanici', '==', st.session_state['username'])
-    
-    query = query.order_by('tarih', direction=firestore.Query.DESCENDING).limit(100)
-    docs = query.stream()
+    # Yönetici tüm kayıtları, diğer kullanıcılar sadece kendi kayıtlarını görür.
+    # Görünümde olmayan liste ve (eskimişse) ayarlar tek seferde, eş zamanlı okunur.
+    records, reads = history_reads(None if st.session_state['role'] == 'admin' else st.session_state['username'])
+    with perf_stage("firestore_history"):
+        sys_conf, results = fetch_with_config(**reads)
+    records = records + results.get('records', [])
     
     data = []
-    # DB'den toleransı çek (sadece gösterim/hesaplama gerekirse diye)
-    sys_conf = get_system_config()
-    current_tol = sys_conf.get('tolerance', 0.25)
-
-    for doc in docs:
-        d = doc.to_dict(); d['id'] = doc.id
-        parts = d.get('parca_detaylari', [])
-        faults = [p for p in parts if p.get('durum') == 'Hatalı']
-        d['hatali_sayi'] = len(faults)
-        max_dev = 0.0; summaries = []
-        for p in faults:
-            p_errs = []
-            for det in p.get('hata_detayi', []):
-                fb=det.get('Fark_Boy',0); fe=det.get('Fark_En',0); fc=det.get('Fark_Cevre',0)
-                curr_max = max(abs(fb), abs(fe), abs(fc))
-                if curr_max > max_dev: max_dev = curr_max
-                errs = []
-                # Burada tolerans esnek olabilir ama geçmiş kayıt olduğu için
-                # o anki duruma göre kaydedilmiş veri gösterilir.
-                # Yine de detayda vurgulamak için güncel toleransı kullanabiliriz
-                if abs(fb)>current_tol: errs.append(f"Boy:{fb:.2f}")
-                if abs(fe)>current_tol: errs.append(f"En:{fe:.2f}")
-                if abs(fc)>current_tol: errs.append(f"Çv:{fc:.2f}")
-                if errs: p_errs.append(f"{det.get('Beden','?')}[{','.join(errs)}]")
-            if p_errs: summaries.append(f"{p.get('parca_adi')}: {' '.join(p_errs)}")
-        d['hata_ozeti'] = " | ".join(summaries)
-        d['max_sapma'] = max_dev
+    # DB'den tolerans kurallarını çek. Geçmiş kayıtta kaydedilmiş veri gösterilir,
+    # detayda vurgulama için güncel kurallar kullanılır.
+    rules = get_tolerance_rules(sys_conf)
+    record_ids = tuple(rec.get('id') for rec in records)
+    cached = st.session_state.get('history_eval')
+    if cached and cached[0] == (rules.key, record_ids):
+        max_devs, summaries = cached[1]
+    else:
+        with perf_stage("tolerance_eval"):
+            max_devs, summaries = summarize_record_faults(records, rules)
+        st.session_state['history_eval'] = ((rules.key, record_ids), (max_devs, summaries))
+
+    for i, rec in enumerate(records):
+        d = dict(rec)
+        d['hatali_sayi'] = sum(1 for p in d.get('parca_detaylari', []) if p.get('durum') == 'Hatalı')
+        d['hata_ozeti'] = summaries.get(i, "")
+        d['max_sapma'] = max_devs.get(i, 0.0)
         d['tarih_str'] = pd.to_datetime(d['tarih']).strftime('%Y-%m-%d %H:%M') if d.get('tarih') else "-"
         data.append(d)
 
@@ -1086,5 +3327,78 @@ def history_page(t):
                 if p['durum']=='Hatalı': st.dataframe(pd.DataFrame(p.get('hata_detayi',[])))
                 else: st.success("OK")
 
+def dashboard_page(t):
+    st.header(t["dashboard_title"])
+    if not db: st.warning("DB Yok"); return
+
+    c1, c2 = st.columns(2)
+    today = datetime.now().date()
+    start = c1.date_input(t["date_from"], today - pd.Timedelta(days=30))
+    end = c2.date_input(t["date_to"], today)
+    docs = load_rollups(start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d'))
+
+    if st.session_state['role'] == 'admin':
+        with st.expander(t["rebuild_rollups_btn"]):
+            st.caption(t["rebuild_rollups_info"])
+            if st.button(t["rebuild_rollups_btn"]):
+                with st.spinner("..."):
+                    st.success(f"{t['rollups_rebuilt']}: {rebuild_rollups()}")
+
+    if not docs: st.info(t["no_data"]); return
+    df = pd.DataFrame(docs)
+
+    f1, f2 = st.columns(2)
+    bus = f1.multiselect("BU", sorted(df['business_unit'].unique()))
+    seasons = f2.multiselect(t["season"], sorted(df['sezon'].unique()))
+    if bus: df = df[df['business_unit'].isin(bus)]
+    if seasons: df = df[df['sezon'].isin(seasons)]
+    if df.empty: st.info(t["no_data"]); return
+
+    def with_rates(frame):
+        frame = frame.copy()
+        frame['hata_orani_%'] = (100 * frame['hatali_kayit'] / frame['kayit'].where(frame['kayit'] > 0)).round(1)
+        frame['parca_hata_orani_%'] = (100 * frame['hatali_parca'] / frame['parca'].where(frame['parca'] > 0)).round(1)
+        return frame
+
+    totals = df[list(ROLLUP_COUNTERS)].sum()
+    m1, m2, m3 = st.columns(3)
+    m1.metric(t["total_records"], int(totals['kayit']))
+    m2.metric(t["status_faulty"], int(totals['hatali_kayit']))
+    m3.metric(t["fault_rate"], f"{100 * totals['hatali_kayit'] / max(totals['kayit'], 1):.1f}%")
+
+    daily = with_rates(df.groupby('gun')[list(ROLLUP_COUNTERS)].sum())
+    st.subheader(t["fault_rate"])
+    st.line_chart(daily[['hata_orani_%', 'parca_hata_orani_%']])
+
+    st.subheader("BU × " + t["season"])
+    st.dataframe(with_rates(df.groupby(['business_unit', 'sezon'])[list(ROLLUP_COUNTERS)].sum()), use_container_width=True)
+
+    st.subheader(t["model"])
+    model_rows = [{'business_unit': r['business_unit'], 'sezon': r['sezon'], 'model_adi': model, **counts}
+                  for r in df.to_dict('records') for model, counts in (r.get('modeller') or {}).items()]
+    if model_rows:
+        df_models = pd.DataFrame(model_rows).groupby(['business_unit', 'sezon', 'model_adi'])[list(ROLLUP_COUNTERS)].sum()
+        st.dataframe(with_rates(df_models).sort_values('hata_orani_%', ascending=False), use_container_width=True)
+
+        # Seçilen modelin parça/beden bazında sapma dağılımı (özetlerden).
+        # Özetler BU içermez; tolerans, modelin seçilen BU'su için kurallardan çözülür.
+        st.subheader(t["drift_title"])
+        model_keys = sorted({(m['model_adi'], m['sezon'], m['business_unit']) for m in model_rows})
+        sel = st.selectbox(t["model"], model_keys, format_func=lambda k: f"{k[0]} ({k[1]}, {k[2]})")
+        df_sk = sketch_table(load_sketches(sel[0]), sel[1])
+        if df_sk.empty: st.info(t["no_data"])
+        else:
+            st.caption(t["drift_info"])
+            dims = st.multiselect(t["drift_dims"], sorted(df_sk['olcu'].unique()), default=sorted(df_sk['olcu'].unique()))
+            df_sk = df_sk[df_sk['olcu'].isin(dims)].sort_values('p95', ascending=False)
+            rules = get_tolerance_rules()
+            df_sk['tolerans'] = [rules.limit(sel[2], str(b).replace('*', '').strip(), d) for b, d in zip(df_sk['Beden'], df_sk['olcu'])]
+            over = (pd.to_numeric(df_sk['p95'], errors='coerce') > df_sk['tolerans']).to_numpy()
+            st.dataframe(df_sk.style.format("{:.3f}", subset=['p50', 'p95', 'max', 'tolerans'], na_rep="-").apply(lambda _: np.where(over, 'background-color:#ffcccc', ''), subset=['p95']), use_container_width=True)
+
 if __name__ == "__main__":
-    main()
+    perf_begin_run()
+    try:
+        main()
+    finally:
+        perf_end_run()
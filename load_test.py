@@ -0,0 +1,458 @@
+"""Kalıp Kontrol Sistemi çok oturumlu yük testi.
+
+Geçmiş ve pano sayfalarını streamlit AppTest ile başsız olarak N oturumda
+çalıştırır. Dosya yüklemesi (AppTest dosya yüklemeyi desteklemez) sayfanın
+yaptığı gibi uygulamanın iş havuzuna (JobManager) gönderilir; kaydetme
+save_record ile kayıt kuyruğuna yazar ve arka plan aktarımı beklenir; şifre
+sıfırlama e-posta kuyruğundan geçer. Firestore için yerel emülatör, e-posta
+için dahili bir SMTP taklidi kullanılır; gerçek servislere dokunulmaz.
+
+Her eylem için p50/p95 gecikme, eylem başına Firestore okuma/yazma ve süreç
+belleği raporlanır. --baseline ile önceki bir --out sonucu verilirse
+karşılaştırılır; gerileme varsa çıkış kodu 1 olur.
+
+Kullanım:
+    gcloud emulators firestore start --host-port=127.0.0.1:8080
+    FIRESTORE_EMULATOR_HOST=127.0.0.1:8080 python load_test.py --sessions 20 --rounds 3 --out sonuc.json
+    FIRESTORE_EMULATOR_HOST=127.0.0.1:8080 python load_test.py --sessions 20 --rounds 3 --baseline sonuc.json
+
+Notlar:
+- AppTest her çalıştırmada süreç genelinde sahte bir Streamlit runtime kurar,
+  bu yüzden sayfa çalıştırmaları bir kilitle sırayla yapılır. "history" ve
+  "dashboard" süreleri kilit içinde ölçülen, sıralanmış tek oturum
+  süreleridir; sayfaların birbiriyle çekişmesini ölçmez. Kilitte beklenen
+  süre ayrıca "page_wait" olarak raporlanır. Yükleme işleri, kayıt aktarımı
+  ve e-posta bu sırada eş zamanlı çalışmaya devam eder; eş zamanlılık
+  ölçümü bu eylemlerden okunmalıdır.
+- AppTest oturumları uygulamayı ayrı bir modül olarak çalıştırdığından
+  süreç genelindeki kaynaklar (kayıt kuyruğu, son kayıtlar dinleyicisi) bu
+  testte iki kez oluşur; okuma sayıları üretime göre biraz yüksek çıkabilir.
+"""
+import argparse
+import importlib.util
+import json
+import logging
+import math
+import os
+import random
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+import warnings
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+DEFAULT_ACTIONS = "history,dashboard,upload,save,reset"
+SIZES = ("XS", "S", "M", "L", "XL", "XXL")
+BUSINESS_UNITS = ("BU1", "BU3", "BU5")
+_APPTEST_LOCK = threading.Lock()
+
+# --------------------------------------------------------------------------
+# SMTP TAKLİDİ
+# --------------------------------------------------------------------------
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """Komutlara olumlu yanıt veren, mesajları sadece sayan SMTP sunucusu."""
+
+    def handle(self):
+        self._send("220 kalip-loadtest ESMTP")
+        while True:
+            line = self.rfile.readline()
+            if not line: return
+            cmd = line.decode(errors="replace").strip().upper()
+            if cmd.startswith(("EHLO", "HELO")):
+                self._send("250 kalip-loadtest")
+            elif cmd == "DATA":
+                self._send("354 End data with <CR><LF>.<CR><LF>")
+                while True:
+                    data = self.rfile.readline()
+                    if not data: return
+                    if data.rstrip(b"\r\n") == b".": break
+                self.server.count_message()
+                self._send("250 OK")
+            elif cmd.startswith("QUIT"):
+                self._send("221 Bye"); return
+            else:
+                self._send("250 OK")
+
+    def _send(self, text):
+        self.wfile.write((text + "\r\n").encode())
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _SMTPHandler)
+        self.messages = 0
+        self._lock = threading.Lock()
+        threading.Thread(target=self.serve_forever, name="smtp-standin", daemon=True).start()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def count_message(self):
+        with self._lock:
+            self.messages += 1
+
+# --------------------------------------------------------------------------
+# ÖLÇÜM
+# --------------------------------------------------------------------------
+
+def percentile(values, q):
+    """En yakın sıra yöntemiyle yüzdelik."""
+    if not values: return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+class Recorder:
+    """Eylem ölçümlerini iş parçacıkları arasında toplar."""
+
+    def __init__(self):
+        self.rows = []
+        self.errors = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def add(self, action, ms, fs_read=None, fs_write=None):
+        with self._lock:
+            self.rows.append({'action': action, 'ms': ms, 'fs_read': fs_read, 'fs_write': fs_write})
+
+    def error(self, action, message):
+        with self._lock:
+            self.errors[action].append(str(message)[:200])
+
+    def summary(self):
+        by_action = defaultdict(list)
+        for row in self.rows: by_action[row['action']].append(row)
+        out = {}
+        for action in sorted(set(by_action) | set(self.errors)):
+            rows = by_action.get(action, [])
+            ms = [r['ms'] for r in rows]
+            reads = [r['fs_read'] for r in rows if r['fs_read'] is not None]
+            writes = [r['fs_write'] for r in rows if r['fs_write'] is not None]
+            out[action] = {
+                'n': len(rows),
+                'p50_ms': round(percentile(ms, 0.50), 1) if ms else None,
+                'p95_ms': round(percentile(ms, 0.95), 1) if ms else None,
+                'max_ms': round(max(ms), 1) if ms else None,
+                'fs_read': round(sum(reads) / len(reads), 2) if reads else None,
+                'fs_write': round(sum(writes) / len(writes), 2) if writes else None,
+                'errors': len(self.errors.get(action, []))
+            }
+        return out
+
+class MemorySampler(threading.Thread):
+    """Süreç belleğini (RSS) aralıklarla örnekler."""
+
+    def __init__(self, rss_kb, interval=0.5):
+        super().__init__(name="rss-sampler", daemon=True)
+        self.rss_kb = rss_kb
+        self.interval = interval
+        self.start_kb = self.peak_kb = rss_kb()
+        self._halt = threading.Event()
+
+    def run(self):
+        while not self._halt.wait(self.interval):
+            self.peak_kb = max(self.peak_kb, self.rss_kb())
+
+    def stop(self):
+        self._halt.set()
+        return {'start_kb': self.start_kb, 'peak_kb': max(self.peak_kb, self.rss_kb()), 'end_kb': self.rss_kb()}
+
+def timed_call(app, recorder, action, fn, *args):
+    """Fonksiyonu bu iş parçacığında ölçüm açıkken çalıştırır; süre ve Firestore işlemlerini kaydeder."""
+    app._perf_local.run = app.PerfRun()
+    t0 = time.perf_counter()
+    try:
+        return fn(*args)
+    except Exception as e:
+        recorder.error(action, e)
+        return None
+    finally:
+        run = app._perf_local.run
+        app._perf_local.run = None
+        recorder.add(action, (time.perf_counter() - t0) * 1000, run.fs['read'], run.fs['write'])
+
+# --------------------------------------------------------------------------
+# HAZIRLIK
+# --------------------------------------------------------------------------
+
+def prepare_workdir(email_settings):
+    """Geçici çalışma klasörü: önbellek, kuyruk ve günlük dosyaları buraya yazılır."""
+    workdir = tempfile.mkdtemp(prefix="kalip_load_")
+    os.makedirs(os.path.join(workdir, ".streamlit"))
+    with open(os.path.join(workdir, ".streamlit", "secrets.toml"), "w", encoding="utf-8") as f:
+        f.write("[email]\n")
+        for key, value in email_settings.items():
+            f.write(f"{key} = {json.dumps(value)}\n")
+    os.chdir(workdir)
+    return workdir
+
+def load_app():
+    """app.py'yi modül olarak yükler (main() çalışmaz)."""
+    spec = importlib.util.spec_from_file_location("kalip_app", APP_PATH)
+    app = importlib.util.module_from_spec(spec)
+    sys.modules["kalip_app"] = app
+    spec.loader.exec_module(app)
+    return app
+
+def user_name(idx):
+    return f"load{idx:03d}"
+
+def seed(app, sessions, records):
+    """Test kullanıcılarını ve geçmiş kayıtlarını oluşturur (sabit numaralarla, tekrar çalıştırılabilir)."""
+    for i in range(sessions):
+        app.create_user(user_name(i), "load", "admin" if i == 0 else "user", f"{user_name(i)}@loadtest.local")
+    now = datetime.now()
+    batch = app.db.batch()
+    for k in range(records):
+        faulty = k % 5 == 0
+        parts = [{"parca_adi": f"P{p}", "durum": "Hatalı" if faulty and p == 0 else "Doğru",
+                  "hata_detayi": [{"Beden": "M", "Fark_Boy": 0.4, "Fark_En": 0.0, "Fark_Cevre": 0.1}] if faulty and p == 0 else [],
+                  "timestamp": now} for p in range(3)]
+        batch.set(app.db.collection('qc_records').document(f"seed{k:06d}"), {
+            'kullanici': user_name(k % sessions), 'tarih': now - timedelta(minutes=k),
+            'business_unit': BUSINESS_UNITS[k % len(BUSINESS_UNITS)], 'model_adi': f"SEED{k % 50:03d}", 'sezon': "SS25",
+            'parca_sayisi': len(parts), 'genel_durum': "Hatalı" if faulty else "Doğru Çevrilmiş", 'parca_detaylari': parts
+        })
+        if (k + 1) % 400 == 0:
+            batch.commit(); batch = app.db.batch()
+    batch.commit()
+    app.rebuild_rollups()
+
+def make_upload(tag, models, parts, rng):
+    """Uzun biçimde (satır başına bir ölçü) CSV yüklemesi üretir."""
+    lines = ["kaynak;parca;beden;boy;en;cevre"]
+    for m in range(models):
+        for p in range(parts):
+            name = f"{tag}M{m}-SS25-P{p}"
+            for s, size in enumerate(SIZES):
+                boy = 50 + s + p; en = 30 + s; cevre = 160 + 2 * s
+                lines.append(f"gerber;L1/{name};{size};{boy};{en};{cevre}")
+                lines.append(f"PP;{name};{size};{boy + rng.choice((0, 0, 0, 0.1, -0.2, 0.4)):.2f};{en};{cevre + rng.choice((0, 0, 0.3)):.2f}")
+    return "\n".join(lines).encode()
+
+# --------------------------------------------------------------------------
+# OTURUM
+# --------------------------------------------------------------------------
+
+class LoadSession:
+    """Tek bir kullanıcının sayfa eylemlerini sırayla yürüten simüle oturum."""
+
+    def __init__(self, app, idx, args, recorder, email_settings):
+        from streamlit.testing.v1 import AppTest
+        self.app = app
+        self.idx = idx
+        self.args = args
+        self.recorder = recorder
+        self.user = user_name(idx)
+        self.rng = random.Random(args.seed + idx)
+        self.labels = app.TRANSLATIONS["TR"]
+        self.at = AppTest.from_file(APP_PATH, default_timeout=args.timeout)
+        self.at.secrets["email"] = email_settings
+        self.at.session_state['logged_in'] = True
+        self.at.session_state['username'] = self.user
+        self.at.session_state['role'] = "admin" if idx == 0 else "user"
+        self.at.session_state['perf_enabled'] = True
+        self._run_page("login", None)
+
+    def _run_page(self, action, menu_key):
+        t_wait = time.perf_counter()
+        with _APPTEST_LOCK:
+            t0 = time.perf_counter()
+            self.recorder.add("page_wait", (t0 - t_wait) * 1000)
+            try:
+                if menu_key is None: self.at.run()
+                else: self.at.sidebar.radio[0].set_value(self.labels[menu_key]).run()
+            except Exception as e:
+                self.recorder.error(action, e); return
+            ms = (time.perf_counter() - t0) * 1000
+        for exc in self.at.exception: self.recorder.error(action, exc.value)
+        try: perf = self.at.session_state['perf_last']
+        except KeyError: perf = {}
+        self.recorder.add(action, ms, perf.get('fs_read'), perf.get('fs_write'))
+
+    def history(self, rnd):
+        self._run_page("history", "menu_history")
+
+    def dashboard(self, rnd):
+        if self.idx != 0: return # pano sadece yöneticiye açık
+        self._run_page("dashboard", "menu_dashboard")
+
+    def upload(self, rnd):
+        """Dosyayı sayfa gibi iş havuzuna gönderir; süre kuyrukta bekleme dahil iş bitene kadardır."""
+        app = self.app
+        name = f"{self.user}_{rnd}.csv"
+        data = make_upload(f"LT{self.idx:03d}R{rnd}", self.args.models, self.args.parts, self.rng)
+        jobs = app.get_job_manager()
+        self.grouped = {}
+        app._perf_local.run = app.PerfRun() # iş, ölçümünü kendi PerfRun'ına yazar
+        t0 = time.perf_counter()
+        try:
+            job_id = jobs.submit(self.user, name, app.file_analysis_job, data, name, None, None)
+        finally:
+            app._perf_local.run = None
+        if job_id is None:
+            self.recorder.error("upload", "JOB_LIMIT"); return
+        job = jobs.get(job_id, self.user)
+        try:
+            job.future.result(timeout=self.args.timeout)
+        except Exception as e:
+            jobs.cancel(job_id, self.user); self.recorder.error("upload", repr(e)); return
+        finally:
+            jobs.forget(job_id)
+        if job.status != 'done':
+            self.recorder.error("upload", job.error or job.status); return
+        self.recorder.add("upload", (time.perf_counter() - t0) * 1000, job.perf.fs['read'], job.perf.fs['write'])
+        self.grouped = job.result[0]
+
+    def save(self, rnd):
+        app = self.app
+        grouped = getattr(self, 'grouped', None) or {}
+        for model_data in grouped.values():
+            parts_list = []
+            for part in model_data['parts']:
+                faulty = bool((app.fark_values(part['df']).abs() > 0.25).any(axis=None))
+                parts_list.append({"parca_adi": part['parca_adi'], "durum": "Hatalı" if faulty else "Doğru", "hata_detayi": [], "timestamp": datetime.now()})
+            doc_data = {
+                'kullanici': self.user, 'tarih': datetime.now(), 'business_unit': BUSINESS_UNITS[self.idx % len(BUSINESS_UNITS)],
+                'model_adi': model_data['model'], 'sezon': model_data['season'], 'parca_sayisi': len(parts_list),
+                'genel_durum': "Hatalı" if any(p['durum'] == "Hatalı" for p in parts_list) else "Doğru Çevrilmiş",
+                'parca_detaylari': parts_list
+            }
+            timed_call(app, self.recorder, "save", app.save_record, doc_data,
+                       [(model_data['model'], model_data['season'], part['parca_adi'], part['df']) for part in model_data['parts']])
+        # Kuyruğun bu kullanıcı için boşalma süresi (arka plan aktarımı)
+        outbox = app.get_outbox(); outbox.flush_now()
+        t0 = time.perf_counter(); deadline = t0 + self.args.timeout
+        while outbox.pending(self.user) and time.perf_counter() < deadline:
+            time.sleep(0.05)
+        if outbox.pending(self.user): self.recorder.error("flush", "timeout")
+        else: self.recorder.add("flush", (time.perf_counter() - t0) * 1000)
+
+    def reset(self, rnd):
+        app = self.app
+        t0 = time.perf_counter(); status = None
+        result = timed_call(app, self.recorder, "reset_request", app.reset_password_flow, f"{self.user}@loadtest.local")
+        if not result or not result[0]:
+            self.recorder.error("reset_mail", result[1] if result else "no result"); return
+        deadline = t0 + self.args.timeout
+        while time.perf_counter() < deadline:
+            status = app.get_email_status(result[1])
+            if status and status['status'] in ('sent', 'failed'): break
+            time.sleep(0.05)
+        if status and status['status'] == 'sent': self.recorder.add("reset_mail", (time.perf_counter() - t0) * 1000)
+        else: self.recorder.error("reset_mail", status['error'] if status else "timeout")
+
+    def run(self, actions, rounds, start_barrier):
+        start_barrier.wait()
+        for rnd in range(rounds):
+            for action in actions:
+                getattr(self, action)(rnd)
+                if self.args.think_ms: time.sleep(self.rng.uniform(0, self.args.think_ms) / 1000)
+
+# --------------------------------------------------------------------------
+# RAPOR
+# --------------------------------------------------------------------------
+
+def print_report(result):
+    print(f"\n{'eylem':<14}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}{'fs okuma':>10}{'fs yazma':>10}{'hata':>6}")
+    for action, s in result['actions'].items():
+        cells = [s['p50_ms'], s['p95_ms'], s['max_ms'], s['fs_read'], s['fs_write']]
+        print(f"{action:<14}{s['n']:>6}" + "".join(f"{'-' if c is None else c:>10}" for c in cells) + f"{s['errors']:>6}")
+    rss = result['rss_kb']
+    print(f"\nRSS (MB): başlangıç {rss['start_kb'] / 1024:.0f} | tepe {rss['peak_kb'] / 1024:.0f} | son {rss['end_kb'] / 1024:.0f}")
+    print(f"SMTP mesajı: {result['smtp_messages']} | süre: {result['elapsed_s']} sn")
+
+def compare_baseline(result, baseline, tolerance):
+    """Önceki sonuca göre gerilemeleri listeler (p95 süresi, eylem başına Firestore işlemi, tepe bellek)."""
+    problems = []
+    for action, cur in result['actions'].items():
+        base = baseline.get('actions', {}).get(action)
+        if not base: continue
+        if cur['p95_ms'] is not None and base.get('p95_ms') and cur['p95_ms'] > base['p95_ms'] * (1 + tolerance) and cur['p95_ms'] - base['p95_ms'] > 5:
+            problems.append(f"{action}: p95 {base['p95_ms']} -> {cur['p95_ms']} ms")
+        for key in ('fs_read', 'fs_write'):
+            if cur[key] is not None and base.get(key) is not None and cur[key] > base[key] + 0.5:
+                problems.append(f"{action}: {key} {base[key]} -> {cur[key]}")
+        if cur['errors'] > base.get('errors', 0):
+            problems.append(f"{action}: hata {base.get('errors', 0)} -> {cur['errors']}")
+    base_peak = baseline.get('rss_kb', {}).get('peak_kb')
+    if base_peak and result['rss_kb']['peak_kb'] > base_peak * (1 + tolerance):
+        problems.append(f"RSS tepe {base_peak // 1024} -> {result['rss_kb']['peak_kb'] // 1024} MB")
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description="Kalıp Kontrol Sistemi yük testi (Firestore emülatörü gerekir).")
+    parser.add_argument("--sessions", type=int, default=10, help="eş zamanlı oturum sayısı")
+    parser.add_argument("--rounds", type=int, default=3, help="her oturumun eylem turu sayısı")
+    parser.add_argument("--actions", default=DEFAULT_ACTIONS, help=f"virgülle ayrılmış eylemler (varsayılan: {DEFAULT_ACTIONS})")
+    parser.add_argument("--models", type=int, default=5, help="yükleme başına model sayısı")
+    parser.add_argument("--parts", type=int, default=10, help="model başına parça sayısı")
+    parser.add_argument("--seed-records", type=int, default=500, help="önceden yazılacak geçmiş kaydı sayısı")
+    parser.add_argument("--think-ms", type=int, default=200, help="eylemler arası en fazla bekleme (ms)")
+    parser.add_argument("--timeout", type=float, default=60, help="tek eylem için zaman aşımı (sn)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="sonuçların yazılacağı JSON dosyası")
+    parser.add_argument("--baseline", help="karşılaştırılacak önceki JSON sonucu")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="izin verilen göreli gerileme (0.2 = %%20)")
+    args = parser.parse_args()
+
+    if not os.environ.get("FIRESTORE_EMULATOR_HOST"):
+        sys.exit("FIRESTORE_EMULATOR_HOST ayarlı değil. Yük testi gerçek veritabanına karşı çalıştırılmaz; önce emülatörü başlatın.")
+    actions = [a.strip() for a in args.actions.split(",") if a.strip()]
+    unknown = set(actions) - {"history", "dashboard", "upload", "save", "reset"}
+    if unknown: sys.exit(f"Bilinmeyen eylem: {', '.join(sorted(unknown))}")
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f: baseline = json.load(f)
+    out_path = os.path.abspath(args.out) if args.out else None
+
+    warnings.filterwarnings("ignore")
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    smtp = SMTPStandIn()
+    email_settings = {"gmail_user": "qc@loadtest.local", "gmail_password": "", "smtp_host": "127.0.0.1", "smtp_port": smtp.port, "smtp_starttls": False}
+    workdir = prepare_workdir(email_settings)
+    print(f"Çalışma klasörü: {workdir} | emülatör: {os.environ['FIRESTORE_EMULATOR_HOST']} | SMTP: 127.0.0.1:{smtp.port}")
+
+    app = load_app()
+    if not app.db: sys.exit("Firestore emülatörüne bağlanılamadı.")
+    print(f"Hazırlık: {args.sessions} kullanıcı, {args.seed_records} kayıt...")
+    seed(app, args.sessions, args.seed_records)
+
+    recorder = Recorder()
+    sampler = MemorySampler(app._rss_kb); sampler.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.sessions) as pool:
+        sessions = list(pool.map(lambda i: LoadSession(app, i, args, recorder, email_settings), range(args.sessions)))
+        barrier = threading.Barrier(args.sessions)
+        for f in [pool.submit(s.run, actions, args.rounds, barrier) for s in sessions]:
+            f.result()
+    result = {
+        'meta': {'started': datetime.now().isoformat(timespec='seconds'), **{k: v for k, v in vars(args).items() if k not in ('out', 'baseline')}},
+        'actions': recorder.summary(),
+        'rss_kb': sampler.stop(),
+        'smtp_messages': smtp.messages,
+        'elapsed_s': round(time.perf_counter() - started, 1),
+        'error_samples': {a: errs[:3] for a, errs in recorder.errors.items()}
+    }
+    print_report(result)
+    if out_path:
+        with open(out_path, "w", encoding="utf-8") as f: json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"Sonuç: {out_path}")
+    smtp.shutdown()
+    if baseline:
+        problems = compare_baseline(result, baseline, args.tolerance)
+        if problems:
+            print("\nGERİLEME:")
+            for p in problems: print(f"  - {p}")
+            sys.exit(1)
+        print("\nÖnceki sonuca göre gerileme yok.")
+
+if __name__ == "__main__":
+    main()